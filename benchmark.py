@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+from sound_visualizer import SoundVisualizer, SpectrumAnalyzer
+
+SIGNALS = ('sweep', 'noise', 'silence', 'clipping')
+# Pinned so that a local settings.json cannot change what gets timed
+PINNED_SETTINGS = {
+    'view_mode': 'bars',
+    'beat_effect': 'off',
+    'FREQUENCY_SCALE': 'log',
+    'SMOOTHING_MODE': 'average',
+    'CHANNEL_MODE': 'mono',
+    'CHANNELS': 1,
+    'show_peaks': True,
+    'sensitivity_factor': 3.0,
+    'gradient_fidelity': 'full',
+}
+MAX_ALLOCATION = 4096
+# Python ints, numpy's small internal caches and tracemalloc itself move the
+# traced total by a few dozen bytes; a leaked array per chunk is far above this
+MAX_GROWTH = 256
+CHANNEL_MODES = (('mono', 1), ('mono', 2), ('stereo', 2), ('channel', 2))
+STAGES = ('sliding_window', 'window', 'fft', 'normalize', 'get_bar_heights', 'beat_detection', 'smooth_bars',
+          'update_visualization', 'draw_ui')
+
+
+def generate_signal(name, rate, chunk, num_chunks, seed=0):
+    total = chunk * num_chunks
+    t = np.arange(total) / rate
+    if name == 'sweep':
+        frequencies = np.geomspace(20, rate / 2, total)
+        signal = 0.5 * np.sin(2 * np.pi * np.cumsum(frequencies) / rate)
+    elif name == 'noise':
+        signal = np.random.default_rng(seed).uniform(-0.5, 0.5, total)
+    elif name == 'silence':
+        signal = np.zeros(total)
+    elif name == 'clipping':
+        signal = np.clip(4.0 * np.sin(2 * np.pi * 110 * t), -1.0, 1.0)
+    else:
+        raise ValueError(f"Unknown signal: {name}")
+    samples = np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+    return samples.reshape(num_chunks, chunk)
+
+
+def percentiles(samples_ns):
+    values = np.asarray(samples_ns, dtype=np.float64) / 1000.0
+    return {
+        'mean_us': round(float(values.mean()), 2),
+        'p50_us': round(float(np.percentile(values, 50)), 2),
+        'p90_us': round(float(np.percentile(values, 90)), 2),
+        'p99_us': round(float(np.percentile(values, 99)), 2),
+        'max_us': round(float(values.max()), 2),
+    }
+
+
+def run_stages(visualizer, chunks):
+    timings = {stage: [] for stage in STAGES}
+    clock = time.perf_counter_ns
+    analyzer = visualizer.analyzer
+
+    for audio_data in chunks:
+        # The same steps SpectrumAnalyzer.flush runs, timed one by one
+        start = clock()
+        analyzer.push(audio_data)
+        timings['sliding_window'].append(clock() - start)
+        count = analyzer.pending
+        analyzer.pending = 0
+
+        start = clock()
+        analyzer.apply_window(count)
+        timings['window'].append(clock() - start)
+
+        start = clock()
+        analyzer.transform(count)
+        timings['fft'].append(clock() - start)
+
+        start = clock()
+        analyzer.normalize(count)
+        timings['normalize'].append(clock() - start)
+
+        start = clock()
+        bar_heights = analyzer.map_bands(count)
+        timings['get_bar_heights'].append(clock() - start)
+
+        start = clock()
+        scale = 1.0 / max(analyzer.height * analyzer.sensitivity, 1e-9)
+        for i in range(count):
+            analyzer.beat_detector.update(analyzer.bands[i], analyzer.peaks[i] * scale)
+        timings['beat_detection'].append(clock() - start)
+
+        start = clock()
+        for i in range(count):
+            visualizer.smooth_bars(bar_heights[i])
+        timings['smooth_bars'].append(clock() - start)
+
+        start = clock()
+        visualizer.update_visualization(analyzer.smoother.output, analyzer.smoother.peak_output)
+        timings['update_visualization'].append(clock() - start)
+
+        visualizer.text_timer = time.time()
+        start = clock()
+        visualizer.draw_ui()
+        timings['draw_ui'].append(clock() - start)
+
+    return timings
+
+
+def check_allocations(rate, chunk, fft_size, hop_size, num_bars, iterations, warmup):
+    results = []
+    for channel_mode, channels in CHANNEL_MODES:
+        analyzer = SpectrumAnalyzer(rate, fft_size, hop_size, num_bars, channels=channels,
+                                    channel_mode=channel_mode)
+        samples = generate_signal('noise', rate, chunk * channels, warmup + iterations)
+        for audio_data in samples[:warmup]:
+            analyzer.process_chunk(audio_data)
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        for audio_data in samples[warmup:]:
+            analyzer.process_chunk(audio_data)
+        retained = tracemalloc.get_traced_memory()[0]
+        for audio_data in samples[warmup:]:
+            analyzer.process_chunk(audio_data)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results.append({
+            'channel_mode': channel_mode,
+            'channels': channels,
+            'chunk': chunk,
+            'fft_size': fft_size,
+            'peak_bytes': peak - baseline,
+            'retained_bytes': current - baseline,
+            'growth_bytes': current - retained,
+        })
+    return results
+
+
+def allocations_ok(result, max_allocation=MAX_ALLOCATION, max_growth=MAX_GROWTH):
+    return result['peak_bytes'] <= max_allocation and result['growth_bytes'] <= max_growth
+
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the Sound Visualizer pipeline")
+    parser.add_argument('--chunks', type=int, nargs='+', default=[512, 1024, 2048], help="CHUNK sizes")
+    parser.add_argument('--bars', type=int, nargs='+', default=[64, 256], help="bar counts")
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[(800, 400), (1920, 1080)],
+                        help="window resolutions, e.g. 800x400")
+    parser.add_argument('--signals', nargs='+', choices=SIGNALS, default=list(SIGNALS))
+    parser.add_argument('--iterations', type=int, default=200, help="chunks per configuration")
+    parser.add_argument('--warmup', type=int, default=10, help="untimed chunks per configuration")
+    parser.add_argument('--output', help="write JSON results to this file instead of stdout")
+    parser.add_argument('--check-allocations', action='store_true',
+                        help="measure heap allocations of the DSP hot path with tracemalloc instead of timing")
+    parser.add_argument('--max-allocation', type=int, default=MAX_ALLOCATION,
+                        help="allowed peak bytes allocated while processing chunks in --check-allocations")
+    parser.add_argument('--max-growth', type=int, default=MAX_GROWTH,
+                        help="allowed growth of retained bytes between N and 2N chunks in --check-allocations")
+    args = parser.parse_args()
+
+    if args.check_allocations:
+        results = []
+        for chunk in args.chunks:
+            for fft_size in (chunk, 4 * chunk):
+                results.extend(check_allocations(48000, chunk, fft_size, chunk // 2, max(args.bars),
+                                                 args.iterations, max(args.warmup, 400)))
+        failed = [result for result in results
+                  if not allocations_ok(result, args.max_allocation, args.max_growth)]
+        for result in results:
+            print(f"chunk={result['chunk']} fft={result['fft_size']} {result['channel_mode']}/{result['channels']}ch: "
+                  f"peak {result['peak_bytes']} B, retained {result['retained_bytes']} B, "
+                  f"growth N..2N {result['growth_bytes']} B", file=sys.stderr)
+        print(json.dumps({'max_allocation': args.max_allocation, 'max_growth': args.max_growth,
+                          'results': results}, indent=4))
+        sys.exit(1 if failed else 0)
+
+    results = []
+    for width, height in args.sizes:
+        visualizer = SoundVisualizer(headless=True, size=(width, height))
+        visualizer.show_ui = True
+        for name, value in PINNED_SETTINGS.items():
+            setattr(visualizer, name, value)
+        for chunk in args.chunks:
+            for num_bars in args.bars:
+                for signal in args.signals:
+                    visualizer.configure_pipeline(chunk=chunk, num_bars=num_bars, fft_size=chunk, hop_size=chunk)
+                    chunks = generate_signal(signal, visualizer.RATE, chunk, args.warmup + args.iterations)
+                    run_stages(visualizer, chunks[:args.warmup])
+                    timings = run_stages(visualizer, chunks[args.warmup:])
+                    results.append({
+                        'size': f"{width}x{height}",
+                        'chunk': chunk,
+                        'bars': num_bars,
+                        'signal': signal,
+                        'stages': {stage: percentiles(values) for stage, values in timings.items()},
+                    })
+                    print(f"{width}x{height} chunk={chunk} bars={num_bars} signal={signal}: "
+                          f"render p50 {results[-1]['stages']['update_visualization']['p50_us']} us",
+                          file=sys.stderr)
+        pygame.quit()
+
+    report = {
+        'version': SoundVisualizer.VERSION,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'iterations': args.iterations,
+        'settings': PINNED_SETTINGS,
+        'results': results,
+    }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
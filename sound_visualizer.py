@@ -1,32 +1,1226 @@
-import pyaudio
+import time
+STARTUP_TIME = time.perf_counter()
+
+import os
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
 import numpy as np
 import pygame
 import threading
-import queue
-import time
-from collections import deque
-import webbrowser
-import win32event
-import win32api
-import winerror
+from collections import OrderedDict
 import sys
-import win32gui
-import win32con
-import keyboard
-import os
 import json
+import wave
+import argparse
+import importlib
+import socket
+import struct
+import mmap
+import multiprocessing
+from multiprocessing import shared_memory
+from functools import lru_cache
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+class WindowsPlatform:
+    def __init__(self):
+        self.modules = {}
+        self.mutex = None
+
+    def module(self, name):
+        module = self.modules.get(name)
+        if module is None:
+            module = importlib.import_module(name)
+            self.modules[name] = module
+        return module
+
+    def acquire_single_instance(self, name):
+        win32api = self.module('win32api')
+        self.mutex = self.module('win32event').CreateMutex(None, 1, name)
+        return win32api.GetLastError() != self.module('winerror').ERROR_ALREADY_EXISTS
+
+    def screen_size(self):
+        win32api = self.module('win32api')
+        win32con = self.module('win32con')
+        return win32api.GetSystemMetrics(win32con.SM_CXSCREEN), win32api.GetSystemMetrics(win32con.SM_CYSCREEN)
+
+    def window_position(self):
+        hwnd = pygame.display.get_wm_info()["window"]
+        window_rect = self.module('win32gui').GetWindowRect(hwnd)
+        return window_rect[0], window_rect[1]
+
+    def move_window(self, x, y):
+        win32con = self.module('win32con')
+        hwnd = pygame.display.get_wm_info()["window"]
+        self.module('win32gui').SetWindowPos(hwnd, win32con.HWND_TOP, x, y, 0, 0,
+                                             win32con.SWP_NOSIZE | win32con.SWP_NOZORDER)
+
+    def cursor_position(self):
+        return self.module('win32api').GetCursorPos()
+
+    def add_hotkey(self, hotkey, callback):
+        self.module('keyboard').add_hotkey(hotkey, callback)
+
+    def remove_hotkeys(self):
+        if 'keyboard' in self.modules:
+            self.modules['keyboard'].unhook_all()
+
+    def open_url(self, url):
+        self.module('webbrowser').open(url)
+
+class GradientCache:
+    NUM_BANDS = 16
+
+    def __init__(self, palettes, max_entries=4):
+        self.palettes = palettes
+        self.max_entries = max_entries
+        self.strips = OrderedDict()
+
+    def get(self, palette_index, width, height, fidelity='full'):
+        key = (palette_index, width, height, fidelity)
+        strip = self.strips.get(key)
+        if strip is None:
+            strip = self.build_strip(self.palettes[palette_index], width, height, fidelity)
+            self.strips[key] = strip
+            while len(self.strips) > self.max_entries:
+                self.strips.popitem(last=False)
+        else:
+            self.strips.move_to_end(key)
+        return strip
+
+    @staticmethod
+    def flat_color(palette):
+        return np.asarray(palette[len(palette) // 2], dtype=np.uint8)
+
+    @staticmethod
+    def gradient_colors(palette, height):
+        colors = np.asarray(palette, dtype=np.float64)
+        num_colors = len(colors)
+        if num_colors == 1:
+            return np.repeat(colors.astype(np.uint8), height, axis=0)
+
+        gradient_pos = 1 - np.arange(height) / height
+        color_index1 = np.minimum((gradient_pos * (num_colors - 1)).astype(np.int64), num_colors - 2)
+        segment_length = 1.0 / (num_colors - 1)
+        segment_pos = (gradient_pos - color_index1 * segment_length) / segment_length
+
+        color1 = colors[color_index1]
+        color2 = colors[color_index1 + 1]
+        return np.trunc(color1 + (color2 - color1) * segment_pos[:, None]).astype(np.uint8)
+
+    @classmethod
+    def colormap(cls, palette, size=256):
+        colors = cls.gradient_colors(palette, size)[::-1]
+        intensity = np.arange(size) / (size - 1)
+        return (colors * intensity[:, None]).astype(np.uint8)
+
+    @classmethod
+    def build_strip(cls, palette, width, height, fidelity='full'):
+        width = max(1, width)
+        height = max(1, height)
+        colors = cls.gradient_colors(palette, height)
+        if fidelity == 'banded':
+            band_starts = (np.arange(height) * cls.NUM_BANDS // height) * height // cls.NUM_BANDS
+            colors = colors[band_starts]
+        elif fidelity == 'flat':
+            colors = np.repeat(cls.flat_color(palette)[None, :], height, axis=0)
+        pixels = np.ascontiguousarray(np.broadcast_to(colors[None, :, :], (width, height, 3)))
+        strip = pygame.surfarray.make_surface(pixels)
+        if pygame.display.get_surface() is not None:
+            strip = strip.convert()
+        return strip
+
+class SettingsStore:
+    def __init__(self, path, delay=0.5):
+        self.path = path
+        self.delay = delay
+        self.pending = None
+        self.last_change = 0.0
+        self.condition = threading.Condition()
+        self.writer = None
+        self.closed = False
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"Error loading settings: {e}")
+        return {}
+
+    def save(self, settings):
+        text = json.dumps(settings, indent=4)
+        with self.condition:
+            if self.closed:
+                self.write(text)
+                return
+            self.pending = text
+            self.last_change = time.monotonic()
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_loop, daemon=True)
+                self.writer.start()
+            self.condition.notify()
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                remaining = self.last_change + self.delay - time.monotonic()
+                if remaining > 0 and not self.closed:
+                    self.condition.wait(remaining)
+                    continue
+                text, self.pending = self.pending, None
+            self.write(text)
+
+    def write(self, text):
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"Error saving settings: {e}")
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.writer is not None:
+            self.writer.join()
+
+class TextLabel:
+    def __init__(self, font, color):
+        self.font = font
+        self.color = color
+        self.text = None
+        self.surface = None
+
+    def render(self, text):
+        if text != self.text:
+            self.text = text
+            self.surface = self.font.render(text, True, self.color)
+        return self.surface
+
+class Waterfall:
+    def __init__(self, width, height, num_bands, colormap):
+        self.width = max(1, width)
+        self.height = max(1, height)
+        self.surface = pygame.Surface((self.width, self.height))
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert()
+        self.surface.fill((0, 0, 0))
+        self.columns = np.arange(self.width) * num_bands // self.width
+        self.levels = np.zeros(num_bands, dtype=np.intp)
+        self.colormap = colormap
+        self.row = 0
+
+    def push(self, heights, max_height):
+        np.multiply(heights, len(self.colormap) - 1, out=self.levels, casting='unsafe')
+        self.levels //= max(1, max_height)
+        np.clip(self.levels, 0, len(self.colormap) - 1, out=self.levels)
+        self.row = (self.row - 1) % self.height
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        pixels[:, self.row] = self.colormap[self.levels[self.columns]]
+        del pixels
+
+    def draw(self, screen):
+        newest = self.height - self.row
+        screen.blit(self.surface, (0, 0), (0, self.row, self.width, newest))
+        if self.row:
+            screen.blit(self.surface, (0, newest), (0, 0, self.width, self.row))
+        return pygame.Rect(0, 0, self.width, self.height)
+
+class BandMapper:
+    SCALES = ('linear', 'log', 'mel', 'bark')
+
+    def __init__(self, rate, fft_size, num_bands, scale='log', min_freq=20.0):
+        if scale not in self.SCALES:
+            raise ValueError(f"Unknown frequency scale: {scale}")
+        self.rate = rate
+        self.fft_size = fft_size
+        self.num_bands = num_bands
+        self.scale = scale
+        self.num_bins = fft_size // 2
+
+        if scale == 'linear':
+            bin_size = max(1, self.num_bins // num_bands)
+            starts = np.minimum(np.arange(num_bands) * bin_size, self.num_bins - 1)
+            ends = starts + bin_size
+            ends[-1] = self.num_bins
+        else:
+            nyquist = rate / 2
+            to_scale, from_scale = self.scale_functions(scale)
+            edges_hz = from_scale(np.linspace(to_scale(min_freq), to_scale(nyquist), num_bands + 1))
+            edges = np.floor(edges_hz * fft_size / rate).astype(np.int64)
+            edges[-1] = self.num_bins
+            starts = np.clip(edges[:-1], 0, self.num_bins - 1)
+            ends = np.clip(np.maximum(edges[1:], starts + 1), 1, self.num_bins)
+
+        self.starts = starts
+        self.ends = ends
+        self.counts = np.maximum(ends - starts, 1).astype(np.float64)
+        self.scratch = {}
+
+    @staticmethod
+    def scale_functions(scale):
+        if scale == 'log':
+            return np.log10, lambda x: 10 ** x
+        if scale == 'mel':
+            return (lambda f: 2595 * np.log10(1 + f / 700),
+                    lambda m: 700 * (10 ** (m / 2595) - 1))
+        if scale == 'bark':
+            return (lambda f: 26.81 * f / (1960 + f) - 0.53,
+                    lambda z: 1960 * (z + 0.53) / (26.28 - z))
+        raise ValueError(f"Unknown frequency scale: {scale}")
+
+    def map(self, magnitudes, out=None):
+        magnitudes = magnitudes[..., :self.num_bins]
+        shape = magnitudes.shape[:-1]
+        scratch = self.scratch.get(shape)
+        if scratch is None:
+            scratch = (np.zeros(shape + (self.num_bins + 1,)), np.zeros(shape + (self.num_bands,)),
+                       np.broadcast_to(self.counts, shape + (self.num_bands,)).copy())
+            self.scratch[shape] = scratch
+        cumsum, lower, counts = scratch
+        np.cumsum(magnitudes, axis=-1, out=cumsum[..., 1:])
+        if out is None:
+            out = np.empty(shape + (self.num_bands,))
+        np.take(cumsum, self.ends, axis=-1, out=out, mode='clip')
+        np.take(cumsum, self.starts, axis=-1, out=lower, mode='clip')
+        out -= lower
+        out /= counts
+        return out
+
+@lru_cache(maxsize=8)
+def get_band_mapper(rate, fft_size, num_bands, scale='log'):
+    return BandMapper(rate, fft_size, num_bands, scale)
+
+class SlidingWindow:
+    def __init__(self, fft_size, hop_size, dtype=np.float64):
+        if not 0 < hop_size <= fft_size:
+            raise ValueError("hop_size must be between 1 and fft_size")
+        self.fft_size = fft_size
+        self.hop_size = hop_size
+        self.dtype = dtype
+        self.length = 2 * fft_size + hop_size
+        self.buffer = np.zeros((0, self.length), dtype=dtype)
+        self.write_pos = fft_size
+        self.filled = 0
+
+    def reset(self, shape):
+        self.buffer = np.zeros(shape + (self.length,), dtype=self.dtype)
+        self.write_pos = self.fft_size
+        self.filled = 0
+
+    def push(self, samples):
+        if self.buffer.shape[:-1] != samples.shape[:-1]:
+            self.reset(samples.shape[:-1])
+
+        position = 0
+        total = samples.shape[-1]
+        while position < total:
+            take = min(self.hop_size - self.filled, total - position)
+            if self.write_pos + take > self.length:
+                # Row by row: a multi-row slice copy within one buffer goes through a temporary
+                for row in self.buffer.reshape(-1, self.length):
+                    row[:self.fft_size] = row[self.write_pos - self.fft_size:self.write_pos]
+                self.write_pos = self.fft_size
+            self.buffer[..., self.write_pos:self.write_pos + take] = samples[..., position:position + take]
+            self.write_pos += take
+            self.filled += take
+            position += take
+            if self.filled == self.hop_size:
+                self.filled = 0
+                yield self.buffer[..., self.write_pos - self.fft_size:self.write_pos]
+
+class BarSmoother:
+    MODES = ('average', 'exponential')
+
+    def __init__(self, num_bars, history_size, mode='average', attack=0.8, decay=0.3,
+                 peak_hold=30, peak_decay=0.95):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown smoothing mode: {mode}")
+        self.mode = mode
+        self.attack = attack
+        self.decay = decay
+        self.peak_hold = peak_hold
+        self.peak_decay = peak_decay
+
+        self.history = np.zeros((history_size, num_bars))
+        self.history_sum = np.zeros(num_bars)
+        self.history_index = 0
+
+        self.level = np.zeros(num_bars)
+        self.delta = np.zeros(num_bars)
+        self.coefficients = np.zeros(num_bars)
+        self.peaks = np.zeros(num_bars)
+        self.peak_timers = np.zeros(num_bars, dtype=np.int32)
+        self.rising = np.zeros(num_bars, dtype=bool)
+        self.decaying = np.zeros(num_bars, dtype=bool)
+        self.decay_factors = np.ones(num_bars)
+
+        self.output = np.zeros(num_bars, dtype=np.int32)
+        self.peak_output = np.zeros(num_bars, dtype=np.int32)
+
+    def update(self, heights):
+        if self.mode == 'average':
+            row = self.history[self.history_index]
+            self.history_sum -= row
+            row[:] = heights
+            self.history_sum += row
+            self.history_index = (self.history_index + 1) % len(self.history)
+            np.divide(self.history_sum, len(self.history), out=self.level)
+        else:
+            np.subtract(heights, self.level, out=self.delta)
+            np.greater(self.delta, 0, out=self.rising)
+            self.coefficients.fill(self.decay)
+            np.copyto(self.coefficients, self.attack, where=self.rising)
+            self.delta *= self.coefficients
+            self.level += self.delta
+
+        np.greater_equal(self.level, self.peaks, out=self.rising)
+        self.peak_timers -= 1
+        np.copyto(self.peak_timers, self.peak_hold, where=self.rising)
+        np.less_equal(self.peak_timers, 0, out=self.decaying)
+        self.decay_factors.fill(1.0)
+        np.copyto(self.decay_factors, self.peak_decay, where=self.decaying)
+        self.peaks *= self.decay_factors
+        np.maximum(self.peaks, self.level, out=self.peaks)
+
+        np.copyto(self.output, self.level, casting='unsafe')
+        np.copyto(self.peak_output, self.peaks, casting='unsafe')
+        return self.output
+
+class BeatDetector:
+    def __init__(self, num_bands, frame_rate, history_size=43, threshold=2.0, min_flux=0.3,
+                 min_fraction=0.2, min_interval=0.25, max_interval=2.0, tempo_history=16):
+        self.num_bands = num_bands
+        self.frame_rate = frame_rate
+        self.history_size = history_size
+        self.threshold = threshold
+        self.min_flux = min_flux
+        self.min_onsets = max(1, int(num_bands * min_fraction))
+        self.min_frames = min_interval * frame_rate
+        self.max_frames = max_interval * frame_rate
+
+        self.levels = np.zeros(num_bands)
+        self.previous = np.zeros(num_bands)
+        self.flux = np.zeros(num_bands)
+        self.squares = np.zeros(num_bands)
+        self.limit = np.zeros(num_bands)
+        self.variance = np.zeros(num_bands)
+        self.onsets = np.zeros(num_bands, dtype=bool)
+        self.history = np.zeros((history_size, num_bands))
+        self.history_squares = np.zeros((history_size, num_bands))
+        self.total = np.zeros(num_bands)
+        self.total_squares = np.zeros(num_bands)
+        self.position = 0
+        self.filled = 0
+
+        self.frame = 0
+        self.last_beat = None
+        self.beats = 0
+        self.intervals = [0] * tempo_history
+        self.interval_count = 0
+        self.tempo = 0.0
+
+    def update(self, bands, scale):
+        np.multiply(bands.reshape(-1), scale, out=self.levels)
+        np.log1p(self.levels, out=self.levels)
+        np.subtract(self.levels, self.previous, out=self.flux)
+        np.maximum(self.flux, 0.0, out=self.flux)
+        self.levels, self.previous = self.previous, self.levels
+        self.frame += 1
+
+        beat = False
+        if self.filled == self.history_size:
+            np.multiply(self.total, 1.0 / self.history_size, out=self.limit)
+            np.multiply(self.total_squares, 1.0 / self.history_size, out=self.variance)
+            np.multiply(self.limit, self.limit, out=self.squares)
+            self.variance -= self.squares
+            np.maximum(self.variance, 0.0, out=self.variance)
+            np.sqrt(self.variance, out=self.variance)
+            self.variance *= self.threshold
+            self.limit += self.variance
+            np.maximum(self.limit, self.min_flux, out=self.limit)
+            np.greater(self.flux, self.limit, out=self.onsets)
+            beat = np.count_nonzero(self.onsets) >= self.min_onsets
+        else:
+            self.onsets.fill(False)
+            self.filled += 1
+
+        np.multiply(self.flux, self.flux, out=self.squares)
+        self.total -= self.history[self.position]
+        self.total_squares -= self.history_squares[self.position]
+        self.history[self.position] = self.flux
+        self.history_squares[self.position] = self.squares
+        self.total += self.flux
+        self.total_squares += self.squares
+        self.position = (self.position + 1) % self.history_size
+
+        if beat and self.last_beat is not None and self.frame - self.last_beat < self.min_frames:
+            beat = False
+        if beat:
+            self.beats += 1
+            if self.last_beat is not None and self.frame - self.last_beat <= self.max_frames:
+                self.intervals[self.interval_count % len(self.intervals)] = self.frame - self.last_beat
+                self.interval_count += 1
+                intervals = sorted(self.intervals[:min(self.interval_count, len(self.intervals))])
+                self.tempo = 60.0 * self.frame_rate / intervals[len(intervals) // 2]
+            self.last_beat = self.frame
+        return beat
+
+class SpectrumAnalyzer:
+    def __init__(self, rate, fft_size, hop_size, num_bars, scale='log', channels=1, channel_mode='mono',
+                 channel_index=0, smoothing_mode='average', history_size=20, attack=0.8, decay=0.3,
+                 height=400, sensitivity=3.0):
+        self.rate = rate
+        self.fft_size = fft_size
+        self.hop_size = min(hop_size, fft_size)
+        self.channels = channels
+        self.channel_mode = channel_mode
+        self.channel_index = channel_index
+        self.height = height
+        self.sensitivity = sensitivity
+        self.sliding_window = SlidingWindow(self.fft_size, self.hop_size, np.float32)
+        if channel_mode == 'stereo':
+            self.num_bands = max(1, num_bars // 2)
+            self.num_bars = self.num_bands * 2
+            self.rows = (2,)
+        else:
+            self.num_bands = num_bars
+            self.num_bars = num_bars
+            self.rows = ()
+        self.band_mapper = get_band_mapper(rate, self.fft_size, self.num_bands, scale)
+        self.smoother = BarSmoother(self.num_bars, history_size, smoothing_mode, attack=attack, decay=decay)
+        self.beat_detector = BeatDetector(self.num_bands * (self.rows[0] if self.rows else 1), rate / self.hop_size)
+        self.window = np.hanning(self.fft_size)
+        self.mono_buffer = np.zeros(0, dtype=np.float32)
+        self.channel_buffer = np.zeros(0, dtype=np.float32)
+        self.pending = 0
+        self.allocate(4)
+
+    def allocate(self, max_frames):
+        shape = (max_frames,) + self.rows
+        frames = np.zeros(shape + (self.fft_size,))
+        if self.pending:
+            frames[:self.pending] = self.frames[:self.pending]
+        self.max_frames = max_frames
+        self.frames = frames
+        self.windows = np.broadcast_to(self.window, frames.shape).copy()
+        self.spectrum = np.zeros(shape + (self.fft_size // 2 + 1,), dtype=np.complex128)
+        self.magnitude = np.zeros(shape + (self.fft_size // 2 + 1,))
+        self.peaks = np.zeros(max_frames)
+        self.bands = np.zeros(shape + (self.num_bands,))
+        self.band_heights = np.zeros(shape + (self.num_bands,), dtype=np.int32)
+        self.heights = np.zeros((max_frames, self.num_bars), dtype=np.int32)
+
+    def deinterleave(self, audio_data):
+        frames = audio_data.reshape(-1, self.channels)
+        if self.channel_mode == 'stereo':
+            if self.channels == 1:
+                return np.broadcast_to(frames[:, 0], (2, len(frames)))
+            return frames[:, :2].T
+        if self.channel_mode == 'channel':
+            return frames[:, min(self.channel_index, self.channels - 1)]
+        if self.channels == 1:
+            return frames[:, 0]
+        if len(self.mono_buffer) != len(frames):
+            self.mono_buffer = np.zeros(len(frames), dtype=np.float32)
+            self.channel_buffer = np.zeros(len(frames), dtype=np.float32)
+        # Mixed int16/float32 ufuncs allocate a cast buffer, so each channel is converted in place first
+        np.copyto(self.mono_buffer, frames[:, 0])
+        for channel in range(1, self.channels):
+            np.copyto(self.channel_buffer, frames[:, channel])
+            self.mono_buffer += self.channel_buffer
+        self.mono_buffer /= self.channels
+        return self.mono_buffer
+
+    def mirror_stereo(self, heights, out):
+        np.copyto(out[..., :self.num_bands], heights[..., 0, ::-1])
+        np.copyto(out[..., self.num_bands:], heights[..., 1, :])
+        return out
+
+    def push(self, audio_data):
+        for frame in self.sliding_window.push(self.deinterleave(audio_data)):
+            if self.pending == self.max_frames:
+                self.allocate(2 * self.max_frames)
+            np.copyto(self.frames[self.pending], frame)
+            self.pending += 1
+
+    def flush(self):
+        count = self.pending
+        if count == 0:
+            return None
+        self.pending = 0
+        heights = self.analyze_frames(count)
+        scale = 1.0 / max(self.height * self.sensitivity, 1e-9)
+        for i in range(count):
+            self.beat_detector.update(self.bands[i], self.peaks[i] * scale)
+            self.smoother.update(heights[i])
+        return self.smoother.output
+
+    def process_chunk(self, audio_data):
+        self.push(audio_data)
+        return self.flush()
+
+    def analyze_frames(self, count):
+        self.apply_window(count)
+        self.transform(count)
+        self.normalize(count)
+        return self.map_bands(count)
+
+    def apply_window(self, count):
+        frames = self.frames[:count]
+        frames *= self.windows[:count]
+
+    def transform(self, count):
+        np.fft.rfft(self.frames[:count], axis=-1, out=self.spectrum[:count])
+        magnitude = self.magnitude[:count]
+        np.abs(self.spectrum[:count], out=magnitude)
+        magnitude[..., -1] = 0.0
+
+    def normalize(self, count):
+        magnitude = self.magnitude[:count]
+        max_magnitude = self.peaks[:count]
+        np.max(magnitude.reshape(count, -1), axis=1, out=max_magnitude)
+        np.maximum(max_magnitude, np.finfo(np.float64).tiny, out=max_magnitude)
+        for i in range(count):
+            magnitude[i] /= max_magnitude[i]
+
+    def map_bands(self, count):
+        fft_magnitude = self.magnitude[:count, ..., :self.fft_size // 2]
+        band_heights = self.get_bar_heights(fft_magnitude, self.bands[:count], self.band_heights[:count])
+        if self.channel_mode == 'stereo':
+            return self.mirror_stereo(band_heights, self.heights[:count])
+        return band_heights
+
+    def get_bar_heights(self, fft_magnitudes, bands=None, out=None):
+        band_magnitudes = self.band_mapper.map(fft_magnitudes, bands)
+        band_magnitudes *= self.height * self.sensitivity
+        if out is None:
+            out = np.empty(band_magnitudes.shape, dtype=np.int32)
+        np.copyto(out, band_magnitudes, casting='unsafe')
+        return np.minimum(out, self.height, out=out)
+
+class AudioRingBuffer:
+    POLICIES = ('drop_oldest', 'drop_newest')
+
+    def __init__(self, capacity, slot_size, policy='drop_oldest'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.data_ready = threading.Condition(self.lock)
+        self.space_ready = threading.Condition(self.lock)
+        self.overruns = 0
+        self.dropped_frames = 0
+        self.allocate(slot_size)
+
+    def allocate(self, slot_size):
+        self.slot_size = slot_size
+        self.slots = np.zeros((self.capacity, slot_size), dtype=np.int16)
+        self.slot_bytes = memoryview(self.slots).cast('B')
+        self.lengths = np.zeros(self.capacity, dtype=np.int64)
+        self.frame_counts = np.zeros(self.capacity, dtype=np.int64)
+        self.timestamps = np.zeros(self.capacity)
+        self.read_timestamp = 0.0
+        self.read_frames = 0
+        self.read_buffer = np.zeros(slot_size, dtype=np.int16)
+        self.read_index = 0
+        self.count = 0
+
+    def resize(self, slot_size):
+        with self.lock:
+            if slot_size > self.slot_size:
+                self.allocate(slot_size)
+            else:
+                self.read_index = 0
+                self.count = 0
+
+    def write(self, in_data, frame_count, timestamp=0.0):
+        with self.lock:
+            data = memoryview(in_data)[:self.slot_size * 2]
+            num_bytes = len(data)
+            if self.count == self.capacity:
+                self.overruns += 1
+                if self.policy == 'drop_newest':
+                    self.dropped_frames += frame_count
+                    return False
+                self.dropped_frames += self.frame_counts[self.read_index]
+                self.read_index = (self.read_index + 1) % self.capacity
+                self.count -= 1
+
+            write_index = (self.read_index + self.count) % self.capacity
+            start = write_index * self.slot_size * 2
+            self.slot_bytes[start:start + num_bytes] = data
+            self.lengths[write_index] = num_bytes // 2
+            self.frame_counts[write_index] = frame_count
+            self.timestamps[write_index] = timestamp
+            self.count += 1
+            self.data_ready.notify()
+        return True
+
+    def read(self, timeout=None):
+        with self.lock:
+            if self.count == 0 and timeout:
+                self.data_ready.wait(timeout)
+            if self.count == 0:
+                return None
+            length = self.lengths[self.read_index]
+            self.read_buffer[:length] = self.slots[self.read_index, :length]
+            self.read_timestamp = self.timestamps[self.read_index]
+            self.read_frames = int(self.frame_counts[self.read_index])
+            self.read_index = (self.read_index + 1) % self.capacity
+            self.count -= 1
+            self.space_ready.notify()
+            return self.read_buffer[:length]
+
+    def wait_for_space(self, timeout=None):
+        with self.lock:
+            if self.count == self.capacity:
+                self.space_ready.wait(timeout)
+            return self.count < self.capacity
+
+    def wake(self):
+        with self.lock:
+            self.data_ready.notify_all()
+
+    def __len__(self):
+        return self.count
+
+class PcmRecorder:
+    MAGIC = b'SVPC'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIIIIIQ')
+    SLOT = struct.Struct('<dII')
+    COUNT = struct.Struct('<Q')
+    COUNT_OFFSET = 24
+
+    def __init__(self, path, rate, channels, slot_samples, capacity, append=False):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.slot_samples = slot_samples
+        self.capacity = capacity
+        self.slot_bytes = self.SLOT.size + slot_samples * 2
+        size = self.HEADER.size + capacity * self.slot_bytes
+        self.count = 0
+        if append and os.path.exists(path):
+            with open(path, 'rb') as f:
+                header = self.HEADER.unpack(f.read(self.HEADER.size))
+            if header[:6] != (self.MAGIC, self.VERSION, rate, channels, slot_samples, capacity):
+                raise ValueError(f"{path} was recorded with a different stream format")
+            self.count = header[6]
+            self.file = open(path, 'r+b')
+            self.mm = mmap.mmap(self.file.fileno(), size)
+        else:
+            self.file = open(path, 'w+b')
+            self.file.truncate(size)
+            self.mm = mmap.mmap(self.file.fileno(), size)
+            for offset in range(0, size, mmap.PAGESIZE):
+                self.mm[offset] = 0
+            self.HEADER.pack_into(self.mm, 0, self.MAGIC, self.VERSION, rate, channels, slot_samples, capacity, 0)
+        self.view = memoryview(self.mm)
+
+    def matches(self, rate, chunk, channels):
+        return (rate, channels, chunk * channels) == (self.rate, self.channels, self.slot_samples)
+
+    def write(self, in_data, frame_count, timestamp):
+        data = memoryview(in_data).cast('B')[:self.slot_samples * 2]
+        frame_count = min(frame_count, len(data) // (2 * self.channels))
+        start = self.HEADER.size + (self.count % self.capacity) * self.slot_bytes
+        self.SLOT.pack_into(self.mm, start, timestamp, frame_count, len(data) // 2)
+        start += self.SLOT.size
+        self.view[start:start + len(data)] = data
+        self.count += 1
+        self.COUNT.pack_into(self.mm, self.COUNT_OFFSET, self.count)
+
+    def close(self):
+        self.view.release()
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+class PcmReplay:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.rate, self.channels, self.slot_samples, self.capacity, self.count = \
+            PcmRecorder.HEADER.unpack_from(self.mm, 0)
+        if magic != PcmRecorder.MAGIC or version != PcmRecorder.VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a Sound Visualizer capture file")
+        self.slot_bytes = PcmRecorder.SLOT.size + self.slot_samples * 2
+        self.view = memoryview(self.mm)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def chunks(self):
+        for n in range(self.count - len(self), self.count):
+            start = PcmRecorder.HEADER.size + (n % self.capacity) * self.slot_bytes
+            timestamp, frame_count, samples = PcmRecorder.SLOT.unpack_from(self.mm, start)
+            start += PcmRecorder.SLOT.size
+            yield self.view[start:start + samples * 2], frame_count, timestamp
+
+    def close(self):
+        if hasattr(self, 'view'):
+            self.view.release()
+        self.mm.close()
+        self.file.close()
+
+class StreamManager:
+    def __init__(self, audio):
+        self.audio = audio
+        self.streams = {}
+        self.active = None
+
+    def open(self, source, device_info, channels, rate, chunk, fmt, callback):
+        self.close(source)
+        stream = self.audio.open(
+            format=fmt,
+            channels=channels,
+            rate=rate,
+            input=True,
+            frames_per_buffer=chunk,
+            input_device_index=device_info['index'],
+            stream_callback=callback
+        )
+        self.streams[source] = {'stream': stream, 'name': device_info['name'], 'channels': channels,
+                                'rate': rate, 'chunk': chunk}
+        return stream
+
+    def close(self, source):
+        entry = self.streams.pop(source, None)
+        if entry is not None:
+            entry['stream'].stop_stream()
+            entry['stream'].close()
+
+    def close_all(self):
+        for source in list(self.streams):
+            self.close(source)
+
+    def is_live(self, source):
+        entry = self.streams.get(source)
+        if entry is None:
+            return False
+        try:
+            return entry['stream'].is_active()
+        except (IOError, OSError):
+            return False
+
+    def activate(self, source):
+        self.active = source
+
+class SpectrumBuffer:
+    def __init__(self, num_rows, size):
+        self.size = size
+        self.buffers = [np.zeros((num_rows, size), dtype=np.int32), np.zeros((num_rows, size), dtype=np.int32)]
+        self.timestamps = [0.0, 0.0]
+        self.beats = [(0, 0.0), (0, 0.0)]
+        self.front = 0
+        self.sequence = 0
+        self.read_sequence = 0
+        self.read_timestamp = 0.0
+        self.read_beats = 0
+        self.read_tempo = 0.0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def publish(self, *rows, timestamp=0.0, beats=0, tempo=0.0):
+        back = 1 - self.front
+        for buffer_row, values in zip(self.buffers[back], rows):
+            np.copyto(buffer_row, values, casting='unsafe')
+        self.timestamps[back] = timestamp
+        self.beats[back] = (beats, tempo)
+        with self.lock:
+            self.front = back
+            self.sequence += 1
+
+    def consume(self, out):
+        with self.lock:
+            if self.sequence == self.read_sequence:
+                return False
+            np.copyto(out, self.buffers[self.front])
+            self.read_timestamp = self.timestamps[self.front]
+            self.read_beats, self.read_tempo = self.beats[self.front]
+            self.dropped += self.sequence - self.read_sequence - 1
+            self.read_sequence = self.sequence
+        return True
+
+class SharedSpectrumBuffer:
+    SEQUENCE, TIMESTAMP, HEIGHT, SENSITIVITY, BEATS, TEMPO, SIZE, NUM_BARS, HISTORY = range(9)
+    HEADER_SIZE = 9
+
+    def __init__(self, num_rows, capacity, name=None):
+        self.capacity = capacity
+        self.owner = name is None
+        header_bytes = self.HEADER_SIZE * 8
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_bytes + num_rows * capacity * 4)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.header = np.ndarray((self.HEADER_SIZE,), dtype=np.float64, buffer=self.shm.buf)
+        self.rows = np.ndarray((num_rows, capacity), dtype=np.int32, buffer=self.shm.buf, offset=header_bytes)
+        if self.owner:
+            self.header.fill(0.0)
+            self.header[self.SIZE] = capacity
+            self.rows.fill(0)
+        self.sequence = 0
+        self.read_sequence = 0
+        self.read_timestamp = 0.0
+        self.read_beats = 0
+        self.read_tempo = 0.0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def set_scale(self, height, sensitivity):
+        self.header[self.HEIGHT] = height
+        self.header[self.SENSITIVITY] = sensitivity
+
+    def scale(self):
+        return int(self.header[self.HEIGHT]), float(self.header[self.SENSITIVITY])
+
+    def set_layout(self, num_bars, history_size):
+        self.header[self.NUM_BARS] = min(num_bars, self.capacity)
+        self.header[self.HISTORY] = history_size
+
+    def layout(self):
+        return int(self.header[self.NUM_BARS]), int(self.header[self.HISTORY])
+
+    @property
+    def size(self):
+        header = self.header
+        return self.capacity if header is None else int(header[self.SIZE])
+
+    def publish(self, *rows, timestamp=0.0, beats=0, tempo=0.0):
+        size = len(rows[0])
+        self.sequence += 1
+        self.header[self.SEQUENCE] = 2 * self.sequence - 1
+        for buffer_row, values in zip(self.rows, rows):
+            np.copyto(buffer_row[:size], values, casting='unsafe')
+        self.header[self.SIZE] = size
+        self.header[self.TIMESTAMP] = timestamp
+        self.header[self.BEATS] = beats
+        self.header[self.TEMPO] = tempo
+        self.header[self.SEQUENCE] = 2 * self.sequence
+
+    def consume(self, out):
+        with self.lock:
+            if self.header is None:
+                return False
+            sequence = int(self.header[self.SEQUENCE])
+            if sequence % 2 or sequence // 2 == self.read_sequence:
+                return False
+            size = int(self.header[self.SIZE])
+            if out.shape[-1] != size:
+                return False
+            np.copyto(out, self.rows[:, :size])
+            timestamp = self.header[self.TIMESTAMP]
+            beats = int(self.header[self.BEATS])
+            tempo = float(self.header[self.TEMPO])
+            if int(self.header[self.SEQUENCE]) != sequence:
+                return False
+        self.read_timestamp = timestamp
+        self.read_beats = beats
+        self.read_tempo = tempo
+        self.dropped += sequence // 2 - self.read_sequence - 1
+        self.read_sequence = sequence // 2
+        return True
+
+    def close(self):
+        with self.lock:
+            self.header = None
+            self.rows = None
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+
+class SpectrumSender:
+    HEADER = struct.Struct('<IdHB')
+    FORMATS = {'uint8': (0, np.uint8), 'float16': (1, np.float16)}
+
+    def __init__(self, target, num_bands, fmt='uint8', ttl=1):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown spectrum output format: {fmt}")
+        self.format_id, self.dtype = self.FORMATS[fmt]
+        if target.startswith('unix:'):
+            if not hasattr(socket, 'AF_UNIX'):
+                raise ValueError("Unix datagram sockets are not supported on this platform")
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.address = target[len('unix:'):]
+        elif target.startswith('udp://'):
+            host, port = target[len('udp://'):].rsplit(':', 1)
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.address = (host, int(port))
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        else:
+            raise ValueError(f"Unsupported spectrum output target: {target}")
+        self.sock.setblocking(False)
+        self.clock_offset = time.time() - time.perf_counter()
+        self.sequence = 0
+        self.sent = 0
+        self.dropped = 0
+        self.allocate(num_bands)
+
+    def allocate(self, num_bands):
+        self.num_bands = num_bands
+        self.packet = bytearray(self.HEADER.size + num_bands * np.dtype(self.dtype).itemsize)
+        self.payload = np.frombuffer(self.packet, dtype=self.dtype, offset=self.HEADER.size)
+        self.scaled = np.zeros(num_bands)
+
+    def send(self, heights, max_height, timestamp):
+        if len(heights) != self.num_bands:
+            self.allocate(len(heights))
+        if self.format_id == 0:
+            np.multiply(heights, 255.0 / max(1, max_height), out=self.scaled)
+            np.clip(self.scaled, 0, 255, out=self.scaled)
+        else:
+            np.multiply(heights, 1.0 / max(1, max_height), out=self.scaled)
+        np.copyto(self.payload, self.scaled, casting='unsafe')
+
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        self.HEADER.pack_into(self.packet, 0, self.sequence, timestamp + self.clock_offset,
+                              self.num_bands, self.format_id)
+        try:
+            self.sock.sendto(self.packet, self.address)
+            self.sent += 1
+        except OSError:
+            self.dropped += 1
+
+    def status(self):
+        return {'sent': self.sent, 'dropped': self.dropped}
+
+    def close(self):
+        self.sock.close()
+
+def capture_timestamp(time_info):
+    now = time.perf_counter()
+    input_delay = 0.0
+    if time_info:
+        adc_time = time_info.get('input_buffer_adc_time', 0.0)
+        stream_time = time_info.get('current_time', 0.0)
+        if adc_time and stream_time:
+            input_delay = max(0.0, stream_time - adc_time)
+    return now - input_delay
+
+def dsp_worker(shm_name, config, stop_event):
+    spectrum_buffer = SharedSpectrumBuffer(2, config['max_bars'], name=shm_name)
+    analyzer = SpectrumAnalyzer(**config['analyzer'])
+    sender = None
+    if config['output']:
+        try:
+            sender = SpectrumSender(config['output'], analyzer.num_bars, config['output_format'])
+        except (OSError, ValueError) as e:
+            print(f"Spectrum output disabled: {e}")
+    audio_buffer = AudioRingBuffer(config['buffer_chunks'], config['chunk'] * config['analyzer']['channels'],
+                                   config['overflow_policy'])
+    recorder = None
+    if config['record']:
+        try:
+            recorder = PcmRecorder(**config['record'])
+        except (OSError, ValueError) as e:
+            print(f"Recording stopped: {e}")
+
+    def callback(in_data, frame_count, time_info, status):
+        timestamp = capture_timestamp(time_info)
+        audio_buffer.write(in_data, frame_count, timestamp)
+        if recorder is not None:
+            recorder.write(in_data, frame_count, timestamp)
+        return (in_data, pyaudio.paContinue)
+
+    audio = None
+    stream = None
+    try:
+        audio = pyaudio.PyAudio()
+        stream = audio.open(
+            format=pyaudio.paInt16,
+            channels=config['analyzer']['channels'],
+            rate=config['analyzer']['rate'],
+            input=True,
+            frames_per_buffer=config['chunk'],
+            input_device_index=config['device_index'],
+            stream_callback=callback
+        )
+        while not stop_event.is_set():
+            audio_data = audio_buffer.read(0.1)
+            if audio_data is None:
+                continue
+            layout = spectrum_buffer.layout()
+            if layout != (config['analyzer']['num_bars'], config['analyzer']['history_size']):
+                config['analyzer']['num_bars'], config['analyzer']['history_size'] = layout
+                analyzer = SpectrumAnalyzer(**config['analyzer'])
+            analyzer.height, analyzer.sensitivity = spectrum_buffer.scale()
+            analyzer.push(audio_data)
+            for _ in range(len(audio_buffer)):
+                analyzer.push(audio_buffer.read())
+            smoothed_heights = analyzer.flush()
+            if smoothed_heights is not None:
+                spectrum_buffer.publish(smoothed_heights, analyzer.smoother.peak_output,
+                                        timestamp=audio_buffer.read_timestamp,
+                                        beats=analyzer.beat_detector.beats, tempo=analyzer.beat_detector.tempo)
+                if sender is not None:
+                    sender.send(smoothed_heights, analyzer.height, audio_buffer.read_timestamp)
+    except Exception as e:
+        print(f"DSP process error: {e}")
+    finally:
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+        if audio is not None:
+            audio.terminate()
+        if recorder is not None:
+            recorder.close()
+        if sender is not None:
+            sender.close()
+        spectrum_buffer.close()
+
+class DspProcess:
+    def __init__(self, config):
+        self.config = config
+        self.spectrum_buffer = SharedSpectrumBuffer(2, config['max_bars'])
+        self.spectrum_buffer.set_scale(config['analyzer']['height'], config['analyzer']['sensitivity'])
+        self.spectrum_buffer.set_layout(config['analyzer']['num_bars'], config['analyzer']['history_size'])
+        context = multiprocessing.get_context('spawn')
+        self.stop_event = context.Event()
+        self.process = context.Process(target=dsp_worker, name='SoundVisualizerDSP', daemon=True,
+                                       args=(self.spectrum_buffer.name, config, self.stop_event))
+
+    def start(self):
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        if self.process.pid is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.spectrum_buffer.close()
+
+class PipelineStats:
+    METRICS = ('capture_to_dsp', 'capture_to_display', 'frame_time', 'queue_depth')
+    TIME_METRICS = ('capture_to_dsp', 'capture_to_display', 'frame_time')
+
+    def __init__(self, size=512):
+        self.size = size
+        self.values = {name: np.zeros(size) for name in self.METRICS}
+        self.counts = {name: 0 for name in self.METRICS}
+
+    def add(self, name, value):
+        self.values[name][self.counts[name] % self.size] = value
+        self.counts[name] += 1
+
+    def summary(self):
+        result = {}
+        for name in self.METRICS:
+            count = min(self.counts[name], self.size)
+            if count == 0:
+                continue
+            values = self.values[name][:count]
+            scale = 1000.0 if name in self.TIME_METRICS else 1.0
+            p50, p95, p99 = np.percentile(values, (50, 95, 99)) * scale
+            result[name] = {
+                'p50': round(float(p50), 2),
+                'p95': round(float(p95), 2),
+                'p99': round(float(p99), 2),
+                'max': round(float(values.max() * scale), 2),
+                'count': self.counts[name],
+            }
+        return result
+
+class QualityGovernor:
+    LEVELS = (
+        {'bars': 1.0, 'gradient': 'full', 'history': 1.0, 'fps': 1.0},
+        {'bars': 1.0, 'gradient': 'banded', 'history': 1.0, 'fps': 1.0},
+        {'bars': 0.5, 'gradient': 'banded', 'history': 0.5, 'fps': 1.0},
+        {'bars': 0.5, 'gradient': 'flat', 'history': 0.5, 'fps': 0.75},
+        {'bars': 0.25, 'gradient': 'flat', 'history': 0.25, 'fps': 0.5},
+    )
+
+    def __init__(self, target_fps, window=60, down_threshold=0.9, up_threshold=0.5, up_delay=3.0):
+        self.target_fps = target_fps
+        self.down_threshold = down_threshold
+        self.up_threshold = up_threshold
+        self.up_delay = up_delay
+        self.frame_times = np.zeros(window)
+        self.count = 0
+        self.good_since = None
+        self.level = 0
+        self.steps_down = 0
+        self.steps_up = 0
+
+    def budget(self):
+        return 1.0 / (self.target_fps * self.LEVELS[self.level]['fps'])
+
+    def update(self, frame_time, now):
+        self.frame_times[self.count] = frame_time
+        self.count += 1
+        if self.count < len(self.frame_times):
+            return None
+
+        self.count = 0
+        mean_time = self.frame_times.mean()
+        budget = self.budget()
+        if mean_time > budget * self.down_threshold:
+            self.good_since = None
+            if self.level < len(self.LEVELS) - 1:
+                self.level += 1
+                self.steps_down += 1
+                return self.level
+        elif mean_time < budget * self.up_threshold:
+            if self.good_since is None:
+                self.good_since = now
+            elif now - self.good_since >= self.up_delay and self.level > 0:
+                self.good_since = None
+                self.level -= 1
+                self.steps_up += 1
+                return self.level
+        else:
+            self.good_since = None
+        return None
+
+    def status(self):
+        return {'level': self.level, 'steps_down': self.steps_down, 'steps_up': self.steps_up}
 
 class SoundVisualizer:
     VERSION = "0.0.6"
     
-    def __init__(self):
-        self.mutex = win32event.CreateMutex(None, 1, 'SoundVisualizerMutex')
-        if win32api.GetLastError() == winerror.ERROR_ALREADY_EXISTS:
+    def __init__(self, headless=False, size=None):
+        self.headless = headless
+        self.platform = WindowsPlatform()
+        self.startup_times = []
+        self.startup_reported = False
+        self.mark_startup('imports')
+        if headless:
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+            os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+        elif not self.platform.acquire_single_instance('SoundVisualizerMutex'):
             print("Приложение уже запущено!")
             sys.exit(1)
 
         self.load_settings()
-        self.register_global_hotkeys()
+        self.device_cache = self.settings.get('devices', {})
+        self.hotkey_actions = []
+        self.hotkey_lock = threading.Lock()
+        if not headless:
+            self.register_global_hotkeys()
+        self.mark_startup('settings_and_hotkeys')
 
         try:
             pygame.init()
@@ -35,30 +1229,68 @@ class SoundVisualizer:
         except Exception as e:
             print(f"Error initializing Pygame: {e}")
             sys.exit(1)
-
-        try:
-            self.audio = pyaudio.PyAudio()
-        except Exception as e:
-            print(f"Error initializing PyAudio: {e}")
-            pygame.quit()
-            sys.exit(1)
-
-        self.FORMAT = pyaudio.paInt16
+        self.mark_startup('pygame_init')
+
+        self.audio = None
+        if not headless:
+            try:
+                self.audio = pyaudio.PyAudio()
+            except Exception as e:
+                print(f"Error initializing PyAudio: {e}")
+                pygame.quit()
+                sys.exit(1)
+        self.mark_startup('pyaudio_init')
+
+        self.FORMAT = pyaudio.paInt16 if pyaudio else None
         self.RATE = 44100
         self.CHUNK = 1024
-        self.NUM_BARS = 64
-        self.SMOOTHING_FACTOR = 0.3
+        self.BLOCK_LATENCY = self.settings.get('block_latency', 0.02)
+        self.FFT_SIZE = self.settings.get('fft_size', 2048)
+        self.HOP_SIZE = self.settings.get('hop_size', 512)
+        self.NUM_BARS = self.settings.get('num_bars', 64)
+        self.FREQUENCY_SCALE = self.settings.get('frequency_scale', 'log')
+        self.CHANNELS = 1
+        self.CHANNEL_MODE = self.settings.get('channel_mode', 'mono')
+        self.CHANNEL_INDEX = self.settings.get('channel_index', 0)
+        self.SMOOTHING_FACTOR = self.settings.get('smoothing_factor', 0.3)
+        self.ATTACK_FACTOR = self.settings.get('attack_factor', 0.8)
+        self.SMOOTHING_MODE = self.settings.get('smoothing_mode', 'average')
         self.HISTORY_SIZE = 20
-
-        self.SCREEN_WIDTH = self.settings.get('window_width', 800)
-        self.SCREEN_HEIGHT = self.settings.get('window_height', 400)
-        self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT), pygame.RESIZABLE | pygame.NOFRAME)
+        self.smoothing_history = self.HISTORY_SIZE
+        self.base_num_bars = self.NUM_BARS
+        self.gradient_fidelity = 'full'
+        self.pipeline_request = None
+        self.pipeline_lock = threading.Lock()
+        self.audio_thread = None
+        self.dsp_process_enabled = self.settings.get('dsp_process', False)
+        self.use_dsp_process = self.dsp_process_enabled and not headless
+        self.dsp_process = None
+        self.device_index = None
+        self.show_peaks = self.settings.get('show_peaks', True)
+        self.view_mode = self.settings.get('view_mode', 'bars')
+        self.waterfall = None
+        self.beat_effect = self.settings.get('beat_effect', 'off')
+        self.BEAT_EFFECT_DURATION = self.settings.get('beat_effect_duration', 0.15)
+        self.beat_level = 0.0
+        self.beat_time = None
+        self.seen_beats = 0
+        self.TARGET_FPS = self.settings.get('target_fps', 60)
+        self.current_fps = self.TARGET_FPS
+        self.adaptive_quality = self.settings.get('adaptive_quality', True) and not headless
+        self.governor = QualityGovernor(self.TARGET_FPS)
+
+        self.SCREEN_WIDTH, self.SCREEN_HEIGHT = size or (self.settings.get('window_width', 800),
+                                                        self.settings.get('window_height', 400))
+        if headless:
+            self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT))
+            self.screen_width, self.screen_height = self.SCREEN_WIDTH, self.SCREEN_HEIGHT
+        else:
+            self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT), pygame.RESIZABLE | pygame.NOFRAME)
+            self.screen_width, self.screen_height = self.platform.screen_size()
         pygame.display.set_caption(f"Sound Visualizer v{self.VERSION}")
 
-        self.screen_width = win32api.GetSystemMetrics(win32con.SM_CXSCREEN)
-        self.screen_height = win32api.GetSystemMetrics(win32con.SM_CYSCREEN)
-
         self.is_fullscreen = False
+        self.show_ui = not headless
         self.dragging = False
         self.drag_offset = (0, 0)
         self.original_size = (self.SCREEN_WIDTH, self.SCREEN_HEIGHT)
@@ -67,6 +1299,10 @@ class SoundVisualizer:
 
         self.BLACK = (0, 0, 0)
         self.WHITE = (255, 255, 255)
+        self.BEAT_FLASH = 0.25
+        self.BEAT_PULSE = 80
+        self.BEAT_EFFECT_STEPS = 4
+        self.background = self.BLACK
 
         self.color_palettes = [
             [(0, 0, 255)], 
@@ -91,19 +1327,54 @@ class SoundVisualizer:
             [(255, 0, 0), (255, 69, 0), (255, 140, 0), (255, 165, 0), (255, 215, 0)], 
         ]
         self.current_palette_index = self.settings.get('color_palette', 4)
+        self.gradient_cache = GradientCache(self.color_palettes)
 
-        self.BAR_WIDTH = self.SCREEN_WIDTH // self.NUM_BARS
         self.BAR_SPACING = 2
-        self.BASE_HEIGHT = self.SCREEN_HEIGHT
-
-        self.audio_queue = queue.Queue()
+        self.configure_pipeline()
+
+        self.audio_buffer = AudioRingBuffer(self.settings.get('audio_buffer_chunks', 8), self.CHUNK * 2,
+                                            self.settings.get('overflow_policy', 'drop_oldest'))
+        self.mix_buffer = AudioRingBuffer(self.audio_buffer.capacity, self.CHUNK * 2, self.audio_buffer.policy)
+        self.mix_sources = self.settings.get('mix_sources', False)
+        self.stream_check_time = 0.0
+        self.clock = pygame.time.Clock()
+        self.DSP_WAIT_TIMEOUT = 0.1
+        self.pipeline_stats = PipelineStats()
+        self.show_stats = self.settings.get('show_stats', False)
+        self.stats_log_path = self.settings.get('stats_log', '')
+        self.stats_log_interval = self.settings.get('stats_log_interval', 10)
+        self.spectrum_output = self.settings.get('spectrum_output', '')
+        self.spectrum_output_format = self.settings.get('spectrum_output_format', 'uint8')
+        self.spectrum_sender = None
+        self.record_path = None
+        self.record_seconds = 300
+        self.record_append = False
+        self.recorder = None
+        if not self.use_dsp_process:
+            self.open_spectrum_output()
+        self.stats_log_time = time.perf_counter()
+        self.stats_refresh_time = 0.0
+        self.stats_lines = ()
+        self.last_frame_time = None
+        self.thread_stats = {
+            'dsp': {'cpu_time': 0.0, 'wakeups': 0, 'idle_wakeups': 0},
+            'render': {'cpu_time': 0.0, 'wakeups': 0, 'idle_wakeups': 0},
+        }
         self.running = True
         self.current_source = self.settings.get('audio_source', "microphone")
-        self.bar_history = [deque([0] * self.NUM_BARS, maxlen=self.HISTORY_SIZE) for _ in range(self.NUM_BARS)]
         self.font = pygame.font.Font(None, 30)
         self.small_font = pygame.font.Font(None, 24)
-        self.stream = None
+        self.version_label = TextLabel(self.small_font, self.WHITE)
+        self.source_label = TextLabel(self.font, self.WHITE)
+        self.sensitivity_label = TextLabel(self.font, self.WHITE)
+        self.instructions_label = TextLabel(self.font, self.WHITE)
+        self.author_label = TextLabel(self.small_font, self.WHITE)
+        self.stats_labels = [TextLabel(self.small_font, self.WHITE) for _ in range(7)]
+        self.ui_state = None
+        self.ui_rects = []
+        self.streams = StreamManager(self.audio)
         self.devices = []
+        self.standby_source = None
 
         self.text_timer = time.time()
         self.text_duration = 5
@@ -113,24 +1384,23 @@ class SoundVisualizer:
         self.telegram_link = "https://t.me/tanukis_code"
         self.button_color = (50, 50, 50)
         self.button_text_color = self.WHITE
+        self.button_label = TextLabel(self.font, self.button_text_color)
         self.author_name = "TANUKIS"
 
+        self.mark_startup('window')
+        if headless:
+            return
+
         if self.window_pos != (0, 0):
-            hwnd = pygame.display.get_wm_info()["window"]
-            win32gui.SetWindowPos(hwnd, win32con.HWND_TOP, self.window_pos[0], self.window_pos[1], 0, 0, 
-                                win32con.SWP_NOSIZE | win32con.SWP_NOZORDER)
+            self.platform.move_window(self.window_pos[0], self.window_pos[1])
 
         if self.settings.get('show_hotkey_hint', True):
             self.show_hotkey_hint()
+        self.mark_startup('hotkey_hint')
 
     def load_settings(self):
-        self.settings = {}
-        try:
-            if os.path.exists('settings.json'):
-                with open('settings.json', 'r') as f:
-                    self.settings = json.load(f)
-        except Exception as e:
-            print(f"Error loading settings: {e}")
+        self.settings_store = SettingsStore('settings.json')
+        self.settings = self.settings_store.load()
 
     def save_settings(self):
         try:
@@ -142,43 +1412,111 @@ class SoundVisualizer:
                 'sensitivity': self.sensitivity_factor,
                 'color_palette': self.current_palette_index,
                 'audio_source': self.current_source,
-                'show_hotkey_hint': self.settings.get('show_hotkey_hint', True)
+                'show_hotkey_hint': self.settings.get('show_hotkey_hint', True),
+                'target_fps': self.TARGET_FPS,
+                'num_bars': self.base_num_bars,
+                'frequency_scale': self.FREQUENCY_SCALE,
+                'smoothing_mode': self.SMOOTHING_MODE,
+                'smoothing_factor': self.SMOOTHING_FACTOR,
+                'attack_factor': self.ATTACK_FACTOR,
+                'show_peaks': self.show_peaks,
+                'audio_buffer_chunks': self.audio_buffer.capacity,
+                'overflow_policy': self.audio_buffer.policy,
+                'devices': self.device_cache,
+                'channel_mode': self.CHANNEL_MODE,
+                'channel_index': self.CHANNEL_INDEX,
+                'fft_size': self.FFT_SIZE,
+                'hop_size': self.HOP_SIZE,
+                'show_stats': self.show_stats,
+                'stats_log': self.stats_log_path,
+                'stats_log_interval': self.stats_log_interval,
+                'adaptive_quality': self.adaptive_quality,
+                'dsp_process': self.dsp_process_enabled,
+                'view_mode': self.view_mode,
+                'spectrum_output': self.spectrum_output,
+                'spectrum_output_format': self.spectrum_output_format,
+                'mix_sources': self.mix_sources,
+                'block_latency': self.BLOCK_LATENCY,
+                'beat_effect': self.beat_effect,
+                'beat_effect_duration': self.BEAT_EFFECT_DURATION
             }
-            with open('settings.json', 'w') as f:
-                json.dump(settings, f, indent=4)
+            self.settings_store.save(settings)
         except Exception as e:
             print(f"Error saving settings: {e}")
 
     def register_global_hotkeys(self):
-        keyboard.add_hotkey('ctrl+alt+m', self.switch_audio_source)
-        keyboard.add_hotkey('ctrl+alt+c', lambda: self.change_color())
-        keyboard.add_hotkey('ctrl+alt+f', self.toggle_fullscreen)
-        keyboard.add_hotkey('ctrl+alt+q', self.quit_application)
-        keyboard.add_hotkey('ctrl+alt+up', lambda: self.adjust_sensitivity(0.1))
-        keyboard.add_hotkey('ctrl+alt+down', lambda: self.adjust_sensitivity(-0.1))
+        self.platform.add_hotkey('ctrl+alt+m', lambda: self.queue_hotkey(self.switch_audio_source))
+        self.platform.add_hotkey('ctrl+alt+c', lambda: self.queue_hotkey(self.change_color))
+        self.platform.add_hotkey('ctrl+alt+f', lambda: self.queue_hotkey(self.toggle_fullscreen))
+        self.platform.add_hotkey('ctrl+alt+q', lambda: self.queue_hotkey(self.quit_application))
+        self.platform.add_hotkey('ctrl+alt+s', lambda: self.queue_hotkey(self.toggle_stats))
+        self.platform.add_hotkey('ctrl+alt+w', lambda: self.queue_hotkey(self.toggle_view))
+        self.platform.add_hotkey('ctrl+alt+up', lambda: self.queue_hotkey(self.adjust_sensitivity, 0.1))
+        self.platform.add_hotkey('ctrl+alt+down', lambda: self.queue_hotkey(self.adjust_sensitivity, -0.1))
+
+    # Called from the keyboard hook thread; the actions run on the render thread in run()
+    def queue_hotkey(self, action, *args):
+        with self.hotkey_lock:
+            self.hotkey_actions.append((action, args))
+
+    def run_hotkey_actions(self):
+        with self.hotkey_lock:
+            actions = self.hotkey_actions
+            self.hotkey_actions = []
+        for action, args in actions:
+            action(*args)
+
+    def mark_startup(self, label):
+        self.startup_times.append((label, time.perf_counter() - STARTUP_TIME))
+
+    def report_startup(self):
+        self.startup_reported = True
+        previous = 0.0
+        parts = []
+        for label, elapsed in self.startup_times:
+            parts.append(f"{label} {(elapsed - previous) * 1000:.0f} ms")
+            previous = elapsed
+        print(f"Startup: {', '.join(parts)} (time to first frame {previous * 1000:.0f} ms)")
 
     def adjust_sensitivity(self, delta):
         self.sensitivity_factor = max(0.1, min(10.0, self.sensitivity_factor + delta))
+        self.update_scale()
         self.text_timer = time.time()
         self.save_settings()
 
     def change_color(self):
         self.current_palette_index = (self.current_palette_index + 1) % len(self.color_palettes)
+        self.refresh_gradient_strip()
         self.text_timer = time.time()
         self.save_settings()
 
+    def toggle_view(self):
+        self.view_mode = 'waterfall' if self.view_mode == 'bars' else 'bars'
+        self.full_redraw_pending = True
+        self.text_timer = time.time()
+        self.save_settings()
+
+    def toggle_stats(self):
+        self.show_stats = not self.show_stats
+        self.stats_refresh_time = 0.0
+        self.save_settings()
+
     def quit_application(self):
         self.save_settings()
         self.running = False
+        self.audio_buffer.wake()
         self.text_timer = time.time()
 
-    def get_audio_devices(self):
+    def get_audio_devices(self, verbose=True):
         self.devices = []
+        for i in range(self.audio.get_device_count()):
+            self.devices.append((i, self.audio.get_device_info_by_index(i)))
+        if not verbose:
+            return self.devices
+
         print("\n=== Доступные аудио устройства ===")
         print("=" * 50)
-        for i in range(self.audio.get_device_count()):
-            device_info = self.audio.get_device_info_by_index(i)
-            self.devices.append((i, device_info))
+        for i, device_info in self.devices:
             print(f"\nУстройство {i}:")
             print(f"  Название: {device_info['name']}")
             print(f"  Входные каналы: {device_info['maxInputChannels']}")
@@ -217,192 +1555,712 @@ class SoundVisualizer:
                 return device_index, device_info
         return None, None
 
-    def audio_callback(self, in_data, frame_count, time_info, status):
-        audio_data = np.frombuffer(in_data, dtype=np.int16)
-        self.audio_queue.put(audio_data)
-        return (in_data, pyaudio.paContinue)
+    def host_api_name(self, device_info):
+        return self.audio.get_host_api_info_by_index(device_info['hostApi'])['name']
 
-    def process_audio(self):
-        while self.running:
-            if not self.audio_queue.empty():
-                audio_data = self.audio_queue.get()
-                
-                window = np.hanning(len(audio_data))
-                windowed_data = audio_data * window
+    def device_matches(self, device_info, cached):
+        return (device_info['maxInputChannels'] > 0 and device_info['name'] == cached['name']
+                and self.host_api_name(device_info) == cached['host_api'])
 
-                fft_result = np.fft.fft(windowed_data)
-                fft_magnitude = np.abs(fft_result[:self.CHUNK // 2])
+    def find_cached_device(self, source):
+        cached = self.device_cache.get(source)
+        if not cached:
+            return None, None
 
-                max_magnitude = np.max(fft_magnitude) if np.max(fft_magnitude) > 0 else 1
-                normalized_magnitude = fft_magnitude / max_magnitude
+        try:
+            device_info = self.audio.get_device_info_by_index(cached['index'])
+            if self.device_matches(device_info, cached):
+                return cached['index'], device_info
+        except (IOError, OSError):
+            pass
+
+        for host_api_index in range(self.audio.get_host_api_count()):
+            host_api_info = self.audio.get_host_api_info_by_index(host_api_index)
+            if host_api_info['name'] != cached['host_api']:
+                continue
+            for i in range(host_api_info['deviceCount']):
+                device_info = self.audio.get_device_info_by_host_api_device_index(host_api_index, i)
+                if self.device_matches(device_info, cached):
+                    return device_info['index'], device_info
+        return None, None
 
-                bar_heights = self.get_bar_heights(normalized_magnitude)
-                smoothed_heights = self.smooth_bars(bar_heights)
-                
-                self.update_visualization(smoothed_heights)
+    def remember_device(self, source, device_index, device_info):
+        entry = {
+            'name': device_info['name'],
+            'host_api': self.host_api_name(device_info),
+            'index': device_index,
+        }
+        if self.device_cache.get(source) == entry:
+            return
+        self.device_cache[source] = entry
+        self.save_settings()
+
+    def open_audio_source(self, source, verbose=True):
+        device_index, device_info = self.find_cached_device(source)
+        if device_index is not None:
+            try:
+                self.initialize_audio_stream(device_index, source)
+                self.remember_device(source, device_index, device_info)
+                return device_info
+            except IOError as e:
+                print(f"Cached {source} device unavailable: {e}")
+            self.device_cache.pop(source, None)
+
+        if not self.devices:
+            self.get_audio_devices(verbose)
+        if source == "speaker":
+            device_index, device_info = self.find_speaker_device()
+        else:
+            device_index, device_info = self.find_microphone_device()
+        if device_index is None:
+            return None
+
+        self.initialize_audio_stream(device_index, source)
+        self.remember_device(source, device_index, device_info)
+        return device_info
+
+    def stream_callback(self, source, rate, chunk, channels):
+        def audio_callback(in_data, frame_count, time_info, status):
+            if source == self.streams.active:
+                timestamp = capture_timestamp(time_info)
+                self.audio_buffer.write(in_data, frame_count, timestamp)
+                recorder = self.recorder
+                if recorder is not None and recorder.matches(rate, chunk, channels):
+                    recorder.write(in_data, frame_count, timestamp)
+            elif self.mix_sources:
+                self.mix_buffer.write(in_data, frame_count, capture_timestamp(time_info))
+            return (in_data, pyaudio.paContinue)
+        return audio_callback
+
+    def push_chunk(self, audio_data):
+        frames = max(1, self.audio_buffer.read_frames)
+        if self.mix_sources:
+            secondary = self.mix_buffer.read()
+            if secondary is not None:
+                audio_data = self.mix_chunks(audio_data, frames, secondary, max(1, self.mix_buffer.read_frames))
+        self.analyzer.channels = len(audio_data) // frames
+        self.analyzer.push(audio_data)
+
+    def mix_chunks(self, primary, primary_frames, secondary, secondary_frames):
+        frames = min(primary_frames, secondary_frames)
+        primary = primary.reshape(primary_frames, -1)
+        secondary = secondary.reshape(secondary_frames, -1)[:frames]
+        if secondary.shape[1] != primary.shape[1]:
+            secondary = secondary.mean(axis=1, keepdims=True)
+        mixed = primary.astype(np.int32)
+        np.add(mixed[:frames], secondary, out=mixed[:frames], casting='unsafe')
+        np.clip(mixed, -32768, 32767, out=mixed)
+        return mixed.astype(np.int16).reshape(-1)
+
+    def process_audio(self):
+        stats = self.thread_stats['dsp']
+        while self.running:
+            with self.pipeline_lock:
+                request, self.pipeline_request = self.pipeline_request, None
+            if request is not None:
+                self.configure_analysis(**request)
+
+            audio_data = self.audio_buffer.read(self.DSP_WAIT_TIMEOUT)
+            stats['wakeups'] += 1
+            stats['cpu_time'] = time.thread_time()
+            if audio_data is None:
+                stats['idle_wakeups'] += 1
+                continue
+
+            backlog = len(self.audio_buffer)
+            self.pipeline_stats.add('queue_depth', backlog)
+            self.push_chunk(audio_data)
+            for _ in range(backlog):
+                self.push_chunk(self.audio_buffer.read())
+            capture_time = self.audio_buffer.read_timestamp
+            smoothed_heights = self.analyzer.flush()
+            if smoothed_heights is not None:
+                self.pipeline_stats.add('capture_to_dsp', time.perf_counter() - capture_time)
+                self.spectrum_buffer.publish(smoothed_heights, self.smoother.peak_output, timestamp=capture_time,
+                                             beats=self.beat_detector.beats, tempo=self.beat_detector.tempo)
+                if self.spectrum_sender is not None:
+                    self.spectrum_sender.send(smoothed_heights, self.SCREEN_HEIGHT, capture_time)
+
+    def process_chunk(self, audio_data):
+        return self.analyzer.process_chunk(audio_data)
+
+    def configure_pipeline(self, rate=None, chunk=None, num_bars=None, fft_size=None, hop_size=None,
+                           history_size=None):
+        self.configure_analysis(rate, chunk, num_bars, fft_size, hop_size, history_size)
+        self.configure_display(self.NUM_BARS)
+
+    def request_pipeline(self, **changes):
+        if self.dsp_process is not None and changes.keys() <= {'num_bars', 'history_size'}:
+            # Bar count and smoothing only rebuild the worker's analyzer; the audio device stays open
+            self.NUM_BARS = min(changes.get('num_bars') or self.NUM_BARS, self.dsp_process.spectrum_buffer.capacity)
+            self.smoothing_history = changes.get('history_size') or self.smoothing_history
+            self.dsp_process.spectrum_buffer.set_layout(self.NUM_BARS, self.smoothing_history)
+        elif self.dsp_process is not None:
+            self.configure_analysis(**changes)
+            self.restart_dsp_process()
+        elif self.audio_thread is not None and self.audio_thread.is_alive():
+            with self.pipeline_lock:
+                if self.pipeline_request is None:
+                    self.pipeline_request = {}
+                self.pipeline_request.update(changes)
+        else:
+            self.configure_pipeline(**changes)
+
+    def configure_analysis(self, rate=None, chunk=None, num_bars=None, fft_size=None, hop_size=None,
+                           history_size=None):
+        self.RATE = rate or self.RATE
+        self.CHUNK = chunk or self.CHUNK
+        self.NUM_BARS = num_bars or self.NUM_BARS
+        self.FFT_SIZE = fft_size or self.FFT_SIZE
+        self.HOP_SIZE = min(hop_size or self.HOP_SIZE, self.FFT_SIZE)
+        self.smoothing_history = history_size or self.smoothing_history
+        self.analyzer = SpectrumAnalyzer(**self.analyzer_config())
+        self.NUM_BARS = self.analyzer.num_bars
+        self.smoother = self.analyzer.smoother
+        self.beat_detector = self.analyzer.beat_detector
+        self.spectrum_buffer = SpectrumBuffer(2, self.NUM_BARS)
+
+    def analyzer_config(self):
+        return {
+            'rate': self.RATE,
+            'fft_size': self.FFT_SIZE,
+            'hop_size': self.HOP_SIZE,
+            'num_bars': self.NUM_BARS,
+            'scale': self.FREQUENCY_SCALE,
+            'channels': self.CHANNELS,
+            'channel_mode': self.CHANNEL_MODE,
+            'channel_index': self.CHANNEL_INDEX,
+            'smoothing_mode': self.SMOOTHING_MODE,
+            'history_size': self.smoothing_history,
+            'attack': self.ATTACK_FACTOR,
+            'decay': self.SMOOTHING_FACTOR,
+            'height': self.SCREEN_HEIGHT,
+            'sensitivity': self.sensitivity_factor,
+        }
+
+    def update_scale(self):
+        self.analyzer.height = self.SCREEN_HEIGHT
+        self.analyzer.sensitivity = self.sensitivity_factor
+        if self.dsp_process is not None:
+            self.dsp_process.spectrum_buffer.set_scale(self.SCREEN_HEIGHT, self.sensitivity_factor)
+
+    def start_recording(self, path, seconds):
+        self.record_path = path
+        self.record_seconds = seconds
+
+    def recorder_config(self, rate=None, chunk=None, channels=None):
+        if not self.record_path:
+            return None
+        rate = rate or self.RATE
+        chunk = chunk or self.CHUNK
+        channels = channels or self.CHANNELS
+        config = {
+            'path': self.record_path,
+            'rate': rate,
+            'channels': channels,
+            'slot_samples': chunk * channels,
+            'capacity': max(1, int(self.record_seconds * rate / chunk)),
+            'append': self.record_append,
+        }
+        self.record_append = True
+        return config
+
+    def open_recorder(self, rate=None, chunk=None, channels=None):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+        config = self.recorder_config(rate, chunk, channels)
+        if config is None:
+            return
+        try:
+            try:
+                self.recorder = PcmRecorder(**config)
+            except ValueError:
+                # The file holds another stream format; keep each format in its own file
+                root, ext = os.path.splitext(self.record_path)
+                config['path'] = f"{root}-{config['rate']}hz-{config['channels']}ch-{config['slot_samples']}{ext}"
+                self.recorder = PcmRecorder(**config)
+                print(f"Stream format changed, recording to {config['path']}")
+        except (OSError, ValueError) as e:
+            print(f"Recording stopped: {e}")
+            self.record_path = None
+
+    def open_spectrum_output(self):
+        if not self.spectrum_output or self.spectrum_sender is not None:
+            return
+        try:
+            self.spectrum_sender = SpectrumSender(self.spectrum_output, self.NUM_BARS, self.spectrum_output_format)
+        except (OSError, ValueError) as e:
+            print(f"Spectrum output disabled: {e}")
+
+    def start_dsp_process(self):
+        self.stop_dsp_process()
+        config = {
+            'analyzer': self.analyzer_config(),
+            'max_bars': max(self.base_num_bars, self.NUM_BARS),
+            'chunk': self.CHUNK,
+            'device_index': self.device_index,
+            'buffer_chunks': self.audio_buffer.capacity,
+            'overflow_policy': self.audio_buffer.policy,
+            'output': self.spectrum_output,
+            'output_format': self.spectrum_output_format,
+            'record': self.recorder_config(),
+        }
+        self.dsp_process = DspProcess(config)
+        self.dsp_process.start()
+        self.spectrum_buffer = self.dsp_process.spectrum_buffer
+
+    def restart_dsp_process(self):
+        if self.dsp_process is not None:
+            self.start_dsp_process()
+
+    def stop_dsp_process(self):
+        if self.dsp_process is not None:
+            self.spectrum_buffer = SpectrumBuffer(2, self.NUM_BARS)
+            self.dsp_process.stop()
+            self.dsp_process = None
+
+    def configure_display(self, num_bars):
+        self.display_bars = num_bars
+        self.display_frame = np.zeros((2, num_bars), dtype=np.int32)
+        self.update_bar_layout()
 
     def smooth_bars(self, current_heights):
-        smoothed = []
-        for i, height in enumerate(current_heights):
-            self.bar_history[i].append(height)
-            avg_height = sum(self.bar_history[i]) / len(self.bar_history[i])
-            smoothed.append(int(avg_height))
-        return smoothed
+        return self.smoother.update(current_heights)
 
     def get_bar_heights(self, fft_magnitudes):
-        bin_size = len(fft_magnitudes) // self.NUM_BARS
-        heights = []
-        for i in range(self.NUM_BARS):
-            start = i * bin_size
-            end = start + bin_size
-            if i == self.NUM_BARS - 1:
-                end = len(fft_magnitudes)
-            bin_magnitudes = fft_magnitudes[start:end]
-            if len(bin_magnitudes) > 0:
-                avg_magnitude = np.mean(bin_magnitudes)
-                height = min(int(avg_magnitude * self.SCREEN_HEIGHT * self.sensitivity_factor), self.SCREEN_HEIGHT)
-                heights.append(height)
+        return self.analyzer.get_bar_heights(fft_magnitudes)
+
+    def update_bar_layout(self):
+        num_bars = self.display_bars
+        self.bar_spacing = self.BAR_SPACING
+        while self.bar_spacing > 0 and self.SCREEN_WIDTH - (num_bars - 1) * self.bar_spacing < num_bars:
+            self.bar_spacing -= 1
+        self.BAR_WIDTH = max(1, (self.SCREEN_WIDTH - (num_bars - 1) * self.bar_spacing) // num_bars)
+        self.BASE_HEIGHT = self.SCREEN_HEIGHT
+        total_viz_width = num_bars * self.BAR_WIDTH + (num_bars - 1) * self.bar_spacing
+        self.bar_x_offset = (self.SCREEN_WIDTH - total_viz_width) // 2
+        self.screen_rect = pygame.Rect(0, 0, self.SCREEN_WIDTH, self.SCREEN_HEIGHT)
+        self.update_scale()
+        self.drawn_heights = np.zeros(num_bars, dtype=np.int32)
+        self.drawn_peaks = np.zeros(num_bars, dtype=np.int32)
+        self.no_peaks = np.zeros(num_bars, dtype=np.int32)
+        self.waterfall = None
+        self.refresh_gradient_strip()
+
+    def refresh_gradient_strip(self):
+        self.gradient_strip = self.gradient_cache.get(self.current_palette_index, self.BAR_WIDTH, self.BASE_HEIGHT,
+                                                      self.gradient_fidelity)
+        self.flat_color = None
+        if self.gradient_fidelity == 'flat':
+            self.flat_color = tuple(GradientCache.flat_color(self.color_palettes[self.current_palette_index]))
+        if self.waterfall is not None:
+            self.waterfall.colormap = GradientCache.colormap(self.color_palettes[self.current_palette_index])
+        self.apply_beat_level()
+        self.full_redraw_pending = True
+
+    def apply_beat_level(self):
+        level = self.beat_level
+        self.background = self.BLACK
+        if self.beat_effect == 'flash' and level:
+            color = GradientCache.flat_color(self.color_palettes[self.current_palette_index])
+            self.background = tuple(int(c * self.BEAT_FLASH * level) for c in color)
+        elif self.beat_effect == 'pulse' and level:
+            boost = int(self.BEAT_PULSE * level)
+            if self.flat_color is not None:
+                self.flat_color = tuple(min(255, int(c) + boost) for c in self.flat_color)
             else:
-                heights.append(0)
-        return heights
-
-    def update_visualization(self, bar_heights):
-        self.screen.fill(self.BLACK)
-        
-        current_palette = self.color_palettes[self.current_palette_index]
-        num_colors = len(current_palette)
-
-        total_viz_width = self.NUM_BARS * self.BAR_WIDTH + (self.NUM_BARS - 1) * self.BAR_SPACING
-        start_x_offset = (self.SCREEN_WIDTH - total_viz_width) // 2
-
-        current_time = time.time()
+                self.gradient_strip = self.gradient_strip.copy()
+                self.gradient_strip.fill((boost, boost, boost), special_flags=pygame.BLEND_RGB_ADD)
+
+    def update_beat_effect(self, beats, now):
+        if self.beat_effect == 'off':
+            return
+        # The count restarts from 0 whenever the analyzer or the DSP process is rebuilt; a drop only resyncs
+        if beats > self.seen_beats:
+            self.beat_time = now
+        self.seen_beats = beats
+        level = 0.0
+        if self.beat_time is not None:
+            elapsed = now - self.beat_time
+            # Quantized so that only a few full redraws happen per beat
+            level = round(max(0.0, 1.0 - elapsed / self.BEAT_EFFECT_DURATION) * self.BEAT_EFFECT_STEPS)
+            level /= self.BEAT_EFFECT_STEPS
+        if level != self.beat_level:
+            self.beat_level = level
+            self.refresh_gradient_strip()
+
+    def render_frame(self):
+        start = time.perf_counter()
+        stats = self.thread_stats['render']
+        stats['wakeups'] += 1
+        stats['cpu_time'] = time.thread_time()
+        spectrum_buffer = self.spectrum_buffer
+        if spectrum_buffer.size != self.display_bars:
+            self.configure_display(spectrum_buffer.size)
+        new_spectrum = spectrum_buffer.consume(self.display_frame)
+        if not new_spectrum:
+            stats['idle_wakeups'] += 1
+        self.update_beat_effect(spectrum_buffer.read_beats, start)
+        self.update_visualization(self.display_frame[0], self.display_frame[1])
+
+        now = time.perf_counter()
+        if self.adaptive_quality:
+            level = self.governor.update(now - start, now)
+            if level is not None:
+                self.apply_quality_level(level)
+        if new_spectrum:
+            self.pipeline_stats.add('capture_to_display', now - spectrum_buffer.read_timestamp)
+        if self.last_frame_time is not None:
+            self.pipeline_stats.add('frame_time', now - self.last_frame_time)
+        self.last_frame_time = now
+        if self.stats_log_path and now - self.stats_log_time >= self.stats_log_interval:
+            self.stats_log_time = now
+            self.write_stats_log()
+
+    def apply_quality_level(self, level):
+        params = QualityGovernor.LEVELS[level]
+        self.current_fps = max(1, int(self.TARGET_FPS * params['fps']))
+        self.gradient_fidelity = params['gradient']
+        self.refresh_gradient_strip()
+        self.request_pipeline(num_bars=max(8, int(self.base_num_bars * params['bars'])),
+                              history_size=max(2, int(self.HISTORY_SIZE * params['history'])))
+        print(f"Quality level {level}: {self.current_fps} fps, {params['gradient']} gradient")
+
+    def stats_report(self):
+        return {
+            'time': time.time(),
+            'stats': self.pipeline_stats.summary(),
+            'overruns': self.audio_buffer.overruns,
+            'dropped_frames': int(self.audio_buffer.dropped_frames),
+            'dropped_spectra': self.spectrum_buffer.dropped,
+            'quality': self.governor.status(),
+            'tempo': round(self.spectrum_buffer.read_tempo, 1),
+            'spectrum_output': self.spectrum_sender.status() if self.spectrum_sender else None,
+            'stream': {'rate': self.RATE, 'chunk': self.CHUNK, 'channels': self.CHANNELS,
+                       'fft_size': self.FFT_SIZE, 'hop_size': self.HOP_SIZE},
+        }
+
+    def write_stats_log(self):
+        try:
+            with open(self.stats_log_path, 'a') as f:
+                f.write(json.dumps(self.stats_report()) + '\n')
+        except Exception as e:
+            print(f"Error writing stats log: {e}")
+
+    def draw_bar(self, x, height, peak, top, bottom):
+        bar_top = max(self.BASE_HEIGHT - height, top)
+        if bottom > bar_top:
+            self.draw_strip(x, bar_top, bottom - bar_top)
+        if peak > height:
+            peak_y = self.BASE_HEIGHT - peak
+            cap_top = max(peak_y, top)
+            cap_bottom = min(peak_y + 2, bottom)
+            if cap_bottom > cap_top:
+                self.draw_strip(x, cap_top, cap_bottom - cap_top)
+
+    def draw_strip(self, x, y, height):
+        if self.flat_color is not None:
+            self.screen.fill(self.flat_color, pygame.Rect(x, y, self.BAR_WIDTH, height).clip(self.screen_rect))
+        else:
+            self.screen.blit(self.gradient_strip, (x, y), (0, y, self.BAR_WIDTH, height))
+
+    def redraw_bars(self, bar_heights, peak_heights):
+        self.screen.fill(self.background)
+        for i in range(self.display_bars):
+            x = self.bar_x_offset + i * (self.BAR_WIDTH + self.bar_spacing)
+            self.draw_bar(x, bar_heights[i], peak_heights[i], 0, self.BASE_HEIGHT)
+        return [self.screen.get_rect()]
+
+    def update_changed_bars(self, bar_heights, peak_heights):
+        dirty_rects = []
+        base = self.BASE_HEIGHT
+        changed = np.flatnonzero((bar_heights != self.drawn_heights) | (peak_heights != self.drawn_peaks))
+        for i in changed:
+            old_height, new_height = self.drawn_heights[i], bar_heights[i]
+            top = base - max(old_height, self.drawn_peaks[i], new_height, peak_heights[i])
+            bottom = base - min(old_height, new_height)
+            if bottom <= top:
+                continue
+            x = self.bar_x_offset + i * (self.BAR_WIDTH + self.bar_spacing)
+            rect = pygame.Rect(x, top, self.BAR_WIDTH, bottom - top).clip(self.screen_rect)
+            if not rect:
+                continue
+            self.screen.fill(self.background, rect)
+            self.draw_bar(x, new_height, peak_heights[i], top, bottom)
+            dirty_rects.append(rect)
+        return dirty_rects
+
+    def restore_bars(self, rect, bar_heights, peak_heights):
+        step = self.BAR_WIDTH + self.bar_spacing
+        first = max(0, (rect.left - self.bar_x_offset) // step)
+        last = min(self.display_bars, (rect.right - self.bar_x_offset) // step + 1)
+        rect = rect.clip(self.screen_rect)
+        self.screen.set_clip(rect)
+        self.screen.fill(self.background, rect)
+        for i in range(first, last):
+            x = self.bar_x_offset + i * step
+            self.draw_bar(x, bar_heights[i], peak_heights[i], rect.top, rect.bottom)
+        self.screen.set_clip(None)
+
+    def update_waterfall(self, bar_heights):
+        if self.waterfall is None:
+            self.waterfall = Waterfall(self.SCREEN_WIDTH, self.SCREEN_HEIGHT, self.display_bars,
+                                       GradientCache.colormap(self.color_palettes[self.current_palette_index]))
+        self.waterfall.push(bar_heights, self.BASE_HEIGHT)
+        return [self.waterfall.draw(self.screen)]
+
+    def update_visualization(self, bar_heights, peak_heights=None):
+        if peak_heights is None or not self.show_peaks:
+            peak_heights = self.no_peaks
+
+        if self.view_mode == 'waterfall':
+            dirty_rects = self.update_waterfall(bar_heights)
+        elif self.full_redraw_pending:
+            dirty_rects = self.redraw_bars(bar_heights, peak_heights)
+        else:
+            dirty_rects = self.update_changed_bars(bar_heights, peak_heights)
+            for rect in self.ui_rects:
+                self.restore_bars(rect, bar_heights, peak_heights)
+        np.copyto(self.drawn_heights, bar_heights, casting='unsafe')
+        np.copyto(self.drawn_peaks, peak_heights, casting='unsafe')
+
+        ui_state, ui_rects = self.draw_ui()
+        stats_state, stats_rects = self.draw_stats()
+        ui_state = (ui_state, stats_state)
+        ui_rects = ui_rects + stats_rects
+        if ui_state != self.ui_state:
+            dirty_rects.extend(self.ui_rects)
+            dirty_rects.extend(ui_rects)
+            self.ui_state = ui_state
+        self.ui_rects = ui_rects
+        self.present(dirty_rects)
+
+    def present(self, dirty_rects):
+        if self.full_redraw_pending:
+            self.full_redraw_pending = False
+            pygame.display.flip()
+        elif dirty_rects:
+            pygame.display.update(dirty_rects)
 
-        for i in range(self.NUM_BARS):
-            x = start_x_offset + i * (self.BAR_WIDTH + self.BAR_SPACING)
-            height = bar_heights[i]
-            y = self.BASE_HEIGHT - height
-            
-            if height > 0 and num_colors > 0:
-                for h in range(height):
-                    gradient_pos = 1 - (h / height)
-                    
-                    if num_colors == 1:
-                        bar_color = current_palette[0]
-                    else:
-                        color_index1 = min(int(gradient_pos * (num_colors - 1)), num_colors - 2)
-                        color_index2 = color_index1 + 1
-                        color1 = current_palette[color_index1]
-                        color2 = current_palette[color_index2]
-                        
-                        segment_length = 1.0 / (num_colors - 1)
-                        segment_pos = (gradient_pos - color_index1 * segment_length) / segment_length
-                        
-                        bar_color = (
-                            int(color1[0] + (color2[0] - color1[0]) * segment_pos),
-                            int(color1[1] + (color2[1] - color1[1]) * segment_pos),
-                            int(color1[2] + (color2[2] - color1[2]) * segment_pos)
-                        )
-                    
-                    pygame.draw.rect(self.screen, bar_color, (x, y + h, self.BAR_WIDTH, 1))
-
-        self.draw_ui()
-        pygame.display.flip()
+    def ui_alpha(self):
+        elapsed_time = time.time() - self.text_timer
+        if elapsed_time <= self.text_duration:
+            return 255
+        fade_progress = min(1, (elapsed_time - self.text_duration) / self.fade_duration)
+        return int(255 * (1 - fade_progress)) & ~7
 
     def draw_ui(self):
-        if not self.is_fullscreen:
-            elapsed_time = time.time() - self.text_timer
-            alpha = 255
-
-            if elapsed_time > self.text_duration:
-                fade_progress = min(1, (elapsed_time - self.text_duration) / self.fade_duration)
-                alpha = 255 * (1 - fade_progress)
-
-            if alpha > 0:
-                version_text = f"Version: {self.VERSION}"
-                version_surface = self.small_font.render(version_text, True, self.WHITE)
-                version_surface.set_alpha(int(alpha))
-                self.screen.blit(version_surface, (10, 10))
-
-                source_text = f"Source: {self.current_source}"
-                text_surface = self.font.render(source_text, True, self.WHITE)
-                text_surface.set_alpha(int(alpha))
-                self.screen.blit(text_surface, (10, 40))
-
-                sensitivity_text = f"Sensitivity: {self.sensitivity_factor:.1f}"
-                sensitivity_surface = self.font.render(sensitivity_text, True, self.WHITE)
-                sensitivity_surface.set_alpha(int(alpha))
-                self.screen.blit(sensitivity_surface, (10, 70))
-
-                instructions = "Ctrl+Alt+M: Switch source | Ctrl+Alt+C: Change color | Ctrl+Alt+F: Fullscreen | Ctrl+Alt+Q: Quit"
-                instructions_surface = self.font.render(instructions, True, self.WHITE)
-                instructions_surface.set_alpha(int(alpha))
-                self.screen.blit(instructions_surface, (10, self.SCREEN_HEIGHT - 40))
-
-                author_text = f"Author: {self.author_name}"
-                author_surface = self.small_font.render(author_text, True, self.WHITE)
-                author_surface.set_alpha(int(alpha))
-                self.screen.blit(author_surface, (10, 100))
-
-            pygame.draw.rect(self.screen, self.button_color, self.telegram_button_rect)
-            button_text_surface = self.font.render("My Telegram", True, self.button_text_color)
-            button_text_rect = button_text_surface.get_rect(center=self.telegram_button_rect.center)
-            self.screen.blit(button_text_surface, button_text_rect)
-
-    def initialize_audio_stream(self, device_index):
-        if self.stream is not None:
-            self.stream.stop_stream()
-            self.stream.close()
-
+        if not self.show_ui or self.is_fullscreen:
+            return None, []
+
+        alpha = self.ui_alpha()
+        rects = []
+        texts = ()
+        if alpha > 0:
+            labels = (
+                (self.version_label, f"Version: {self.VERSION}", (10, 10)),
+                (self.source_label, f"Source: {self.current_source}", (10, 40)),
+                (self.sensitivity_label, f"Sensitivity: {self.sensitivity_factor:.1f}", (10, 70)),
+                (self.instructions_label, "Ctrl+Alt+M: Switch source | Ctrl+Alt+C: Change color | Ctrl+Alt+F: Fullscreen | Ctrl+Alt+Q: Quit",
+                 (10, self.SCREEN_HEIGHT - 40)),
+                (self.author_label, f"Author: {self.author_name}", (10, 100)),
+            )
+            for label, text, position in labels:
+                surface = label.render(text)
+                surface.set_alpha(alpha)
+                rects.append(self.screen.blit(surface, position))
+            texts = tuple(text for _, text, _ in labels)
+
+        rects.append(pygame.draw.rect(self.screen, self.button_color, self.telegram_button_rect))
+        button_text_surface = self.button_label.render("My Telegram")
+        button_text_rect = button_text_surface.get_rect(center=self.telegram_button_rect.center)
+        self.screen.blit(button_text_surface, button_text_rect)
+        return (alpha, texts, self.telegram_button_rect.topleft), rects
+
+    def draw_stats(self):
+        if not self.show_stats or not self.show_ui or self.headless:
+            return None, []
+
+        now = time.perf_counter()
+        if now - self.stats_refresh_time >= 0.5:
+            self.stats_refresh_time = now
+            summary = self.pipeline_stats.summary()
+            empty = {'p50': 0, 'p95': 0, 'max': 0}
+            dsp = summary.get('capture_to_dsp', empty)
+            display = summary.get('capture_to_display', empty)
+            frame = summary.get('frame_time', empty)
+            depth = summary.get('queue_depth', empty)
+            self.stats_lines = (
+                f"DSP latency p50/p95: {dsp['p50']:.1f} / {dsp['p95']:.1f} ms",
+                f"Display latency p50/p95: {display['p50']:.1f} / {display['p95']:.1f} ms",
+                f"Frame time p50/p95: {frame['p50']:.1f} / {frame['p95']:.1f} ms",
+                f"Queue depth p50/max: {depth['p50']:.0f} / {depth['max']:.0f}",
+                f"Overruns: {self.audio_buffer.overruns}, dropped spectra: {self.spectrum_buffer.dropped}",
+                f"Quality level: {self.governor.level} (down {self.governor.steps_down}, up {self.governor.steps_up})",
+                f"Beats: {self.spectrum_buffer.read_beats}, tempo: {self.spectrum_buffer.read_tempo:.1f} BPM",
+            )
+
+        rects = []
+        x = self.SCREEN_WIDTH - 300
+        for i, (label, text) in enumerate(zip(self.stats_labels, self.stats_lines)):
+            rects.append(self.screen.blit(label.render(text), (x, 50 + i * 20)))
+        return self.stats_lines, rects
+
+    def report_thread_stats(self):
+        for name, stats in self.thread_stats.items():
+            print(f"{name} thread: {stats['cpu_time']:.2f} s CPU, {stats['wakeups']} wakeups "
+                  f"({stats['idle_wakeups']} idle)")
+
+    def negotiate_format(self, device_info):
+        device_index = device_info['index']
+        channels = min(int(device_info['maxInputChannels']), 2 if self.CHANNEL_MODE == 'stereo' else 1)
+        rate = self.RATE
+        for candidate in dict.fromkeys((int(device_info['defaultSampleRate']), 48000, 44100)):
+            try:
+                if self.audio.is_format_supported(candidate, input_device=device_index,
+                                                  input_channels=channels, input_format=self.FORMAT):
+                    rate = candidate
+                    break
+            except ValueError:
+                continue
+        chunk = 2 ** max(6, int(np.round(np.log2(rate * self.BLOCK_LATENCY))))
+        return rate, chunk
+
+    def negotiate_channels(self, device_index, max_channels, rate=None):
+        if self.CHANNEL_MODE == 'stereo':
+            wanted = 2
+        elif self.CHANNEL_MODE == 'channel':
+            wanted = self.CHANNEL_INDEX + 1
+        else:
+            wanted = 1
+
+        for channels in sorted({min(wanted, max_channels), max_channels}):
+            try:
+                if self.audio.is_format_supported(rate or self.RATE, input_device=device_index,
+                                                  input_channels=channels, input_format=self.FORMAT):
+                    return channels
+            except ValueError:
+                continue
+        return max_channels
+
+    def initialize_audio_stream(self, device_index, source="microphone"):
+        self.streams.close(source)
         device_info = self.audio.get_device_info_by_index(device_index)
-        channels = int(device_info['maxInputChannels'])
-        
-        if channels == 0:
+        max_channels = int(device_info['maxInputChannels'])
+
+        if max_channels == 0:
             raise IOError("Selected device has no input channels")
 
-        self.stream = self.audio.open(
-            format=self.FORMAT,
-            channels=channels,
-            rate=self.RATE,
-            input=True,
-            frames_per_buffer=self.CHUNK,
-            input_device_index=device_index,
-            stream_callback=self.audio_callback
-        )
-        return self.stream
+        primary = self.streams.active is None or source == self.streams.active or self.use_dsp_process
+        if self.mix_sources and not primary:
+            rate, chunk = self.RATE, self.CHUNK
+        else:
+            rate, chunk = self.negotiate_format(device_info)
+        channels = self.negotiate_channels(device_index, max_channels, rate)
+        if primary:
+            self.CHANNELS = channels
+            self.analyzer.channels = channels
+            self.device_index = device_index
+            if (rate, chunk) != (self.RATE, self.CHUNK):
+                if self.use_dsp_process:
+                    self.configure_analysis(rate=rate, chunk=chunk)
+                else:
+                    self.request_pipeline(rate=rate, chunk=chunk)
+            print(f"Audio stream: {rate} Hz, {chunk} frames ({chunk / rate * 1000:.1f} ms), {channels} ch")
+        if self.use_dsp_process:
+            self.streams.close_all()
+            try:
+                self.start_dsp_process()
+                return None
+            except (OSError, ValueError) as e:
+                print(f"DSP process unavailable, using DSP thread: {e}")
+                self.stop_dsp_process()
+                self.use_dsp_process = False
+                self.open_spectrum_output()
+
+        if chunk * channels > self.audio_buffer.slot_size:
+            self.audio_buffer.resize(chunk * channels)
+            self.mix_buffer.resize(chunk * channels)
+        if self.streams.active is None:
+            self.streams.activate(source)
+        if source == self.streams.active:
+            self.open_recorder(rate, chunk, channels)
+        return self.streams.open(source, device_info, channels, rate, chunk, self.FORMAT,
+                                 self.stream_callback(source, rate, chunk, channels))
+
+    def open_standby_stream(self, source):
+        if self.dsp_process is not None or self.streams.is_live(source):
+            return
+        try:
+            device_info = self.open_audio_source(source, verbose=False)
+        except IOError as e:
+            print(f"Standby {source} stream unavailable: {e}")
+            return
+        if device_info is not None:
+            print(f"Standby {source}: {device_info['name']}")
+
+    def check_streams(self):
+        if self.dsp_process is not None and not self.dsp_process.is_alive():
+            print("DSP process stopped, using DSP thread")
+            self.stop_dsp_process()
+            self.use_dsp_process = False
+            self.request_pipeline()
+            self.open_spectrum_output()
+            try:
+                if self.open_audio_source(self.current_source) is not None:
+                    self.open_standby_stream("speaker" if self.current_source == "microphone" else "microphone")
+            except IOError as e:
+                print(f"Error reopening {self.current_source}: {e}")
+            return
+
+        for source in list(self.streams.streams):
+            if self.streams.is_live(source):
+                continue
+            print(f"{source} stream stopped, reopening")
+            try:
+                if self.open_audio_source(source) is None:
+                    self.streams.close(source)
+            except IOError as e:
+                print(f"Error reopening {source}: {e}")
+                self.streams.close(source)
+
+    def activate_source(self, source, name):
+        self.streams.activate(source)
+        self.current_source = source
+        entry = self.streams.streams.get(source)
+        if entry is not None:
+            self.CHANNELS = entry['channels']
+            if (entry['rate'], entry['chunk']) != (self.RATE, self.CHUNK):
+                self.request_pipeline(rate=entry['rate'], chunk=entry['chunk'])
+            if self.recorder is not None and not self.recorder.matches(entry['rate'], entry['chunk'], entry['channels']):
+                self.open_recorder(entry['rate'], entry['chunk'], entry['channels'])
+        print(f"Switched to {source}: {name}")
+        self.text_timer = time.time()
 
     def switch_audio_source(self):
-        if self.current_source == "microphone":
-            device_index, device_info = self.find_speaker_device()
-            if device_index is not None:
-                try:
-                    self.initialize_audio_stream(device_index)
-                    self.current_source = "speaker"
-                    print(f"Switched to speaker: {device_info['name']}")
-                    self.text_timer = time.time()
-                    return
-                except IOError as e:
-                    print(f"Error switching to speaker: {e}")
-            else:
-                print("\nNo speaker device found. To enable system audio capture:")
-                print("1. Open Windows Settings")
-                print("2. Go to System > Sound")
-                print("3. Click 'More sound settings'")
-                print("4. In the Recording tab, right-click and enable 'Show Disabled Devices'")
-                print("5. Look for 'Stereo Mix' or 'What U Hear' and enable it")
-                print("6. If not available, try updating your audio drivers")
+        source = "speaker" if self.current_source == "microphone" else "microphone"
+        if self.dsp_process is None and self.streams.is_live(source):
+            self.activate_source(source, self.streams.streams[source]['name'])
+            return
+
+        try:
+            device_info = self.open_audio_source(source)
+        except IOError as e:
+            print(f"Error switching to {source}: {e}")
+            return
+        if device_info is not None:
+            self.activate_source(source, device_info['name'])
+        elif source == "speaker":
+            print("\nNo speaker device found. To enable system audio capture:")
+            print("1. Open Windows Settings")
+            print("2. Go to System > Sound")
+            print("3. Click 'More sound settings'")
+            print("4. In the Recording tab, right-click and enable 'Show Disabled Devices'")
+            print("5. Look for 'Stereo Mix' or 'What U Hear' and enable it")
+            print("6. If not available, try updating your audio drivers")
         else:
-            device_index, device_info = self.find_microphone_device()
-            if device_index is not None:
-                try:
-                    self.initialize_audio_stream(device_index)
-                    self.current_source = "microphone"
-                    print(f"Switched to microphone: {device_info['name']}")
-                    self.text_timer = time.time()
-                    return
-                except IOError as e:
-                    print(f"Error switching to microphone: {e}")
-            else:
-                print("No microphone device found")
+            print("No microphone device found")
 
     def toggle_fullscreen(self):
         hwnd = pygame.display.get_wm_info()["window"]
@@ -415,8 +2273,7 @@ class SoundVisualizer:
             self.SCREEN_WIDTH, self.SCREEN_HEIGHT = self.original_size
         
         self.is_fullscreen = not self.is_fullscreen
-        self.BAR_WIDTH = self.SCREEN_WIDTH // self.NUM_BARS
-        self.BASE_HEIGHT = self.SCREEN_HEIGHT
+        self.update_bar_layout()
         self.telegram_button_rect = pygame.Rect(self.SCREEN_WIDTH - 150, 10, 140, 30)
         self.text_timer = time.time()
 
@@ -549,7 +2406,35 @@ class SoundVisualizer:
         self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT), pygame.RESIZABLE | pygame.NOFRAME)
         pygame.display.set_caption(f"Sound Visualizer v{self.VERSION}")
 
-    def run(self):
+    def replay_audio(self, replay, realtime):
+        start_time = time.perf_counter()
+        next_chunk_at = start_time
+        previous = None
+        chunks = 0
+        for audio_data, frame_count, timestamp in replay.chunks():
+            if not self.running:
+                break
+            if realtime:
+                if previous is not None:
+                    next_chunk_at += min(max(timestamp - previous, 0.0), 1.0)
+                previous = timestamp
+                delay = next_chunk_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                while self.running and not self.audio_buffer.wait_for_space(self.DSP_WAIT_TIMEOUT):
+                    pass
+            self.audio_buffer.write(audio_data, frame_count, time.perf_counter())
+            chunks += 1
+        audio_data = None
+
+        while self.running and len(self.audio_buffer):
+            time.sleep(0.01)
+        print(f"Replay finished: {chunks} chunks in {time.perf_counter() - start_time:.2f} s")
+        self.running = False
+        self.audio_buffer.wake()
+
+    def run(self, replay=None, realtime=True):
         try:
             print(f"\nSound Visualizer v{self.VERSION}")
             print("=" * 50)
@@ -559,27 +2444,46 @@ class SoundVisualizer:
             print("Ctrl+Alt+F - Переключить полноэкранный режим")
             print("Ctrl+Alt+Q - Выйти из приложения")
             print("Ctrl+Alt+Up/Down - Изменить чувствительность")
+            print("Ctrl+Alt+S - Показать статистику задержек")
+            print("Ctrl+Alt+W - Переключить полосы / спектрограмму")
             print("=" * 50)
 
-            devices = self.get_audio_devices()
-            if not devices:
-                print("Аудио устройства не найдены!")
-                return
-
-            device_index, device_info = self.find_microphone_device()
-            if device_index is not None:
+            replay_thread = None
+            if replay:
+                try:
+                    replay_source = PcmReplay(replay)
+                except (OSError, ValueError) as e:
+                    print(f"Ошибка открытия записи: {e}")
+                    return
+                self.CHANNELS = replay_source.channels
+                self.configure_pipeline(rate=replay_source.rate,
+                                        chunk=replay_source.slot_samples // replay_source.channels)
+                self.audio_buffer.resize(replay_source.slot_samples)
+                print(f"\nВоспроизведение записи: {replay} ({len(replay_source)} блоков)")
+                replay_thread = threading.Thread(target=self.replay_audio, args=(replay_source, realtime))
+            else:
                 try:
-                    self.initialize_audio_stream(device_index)
-                    print(f"\nИнициализирован микрофон: {device_info['name']}")
+                    device_info = self.open_audio_source("microphone")
                 except IOError as e:
                     print(f"Ошибка инициализации микрофона: {e}")
                     return
-            else:
-                print("Подходящий микрофон не найден!")
-                return
+                if device_info is None:
+                    print("Подходящий микрофон не найден!")
+                    return
+                print(f"\nИнициализирован микрофон: {device_info['name']}")
+                self.current_source = "microphone"
+                if self.dsp_process is not None:
+                    print("DSP выполняется в отдельном процессе")
+                else:
+                    # Opened after the first frame: finding a loopback device may need a full device scan
+                    self.standby_source = "speaker"
+            self.mark_startup('audio_stream')
 
             audio_thread = threading.Thread(target=self.process_audio)
+            self.audio_thread = audio_thread
             audio_thread.start()
+            if replay_thread is not None:
+                replay_thread.start()
 
             while self.running:
                 for event in pygame.event.get():
@@ -596,40 +2500,155 @@ class SoundVisualizer:
                             self.change_color()
                         elif event.key == pygame.K_f:
                             self.toggle_fullscreen()
+                        elif event.key == pygame.K_s:
+                            self.toggle_stats()
+                        elif event.key == pygame.K_w:
+                            self.toggle_view()
                     elif event.type == pygame.MOUSEBUTTONDOWN:
                         if event.button == 1:
                             if self.telegram_button_rect.collidepoint(event.pos):
-                                webbrowser.open(self.telegram_link)
+                                self.platform.open_url(self.telegram_link)
                             elif not self.is_fullscreen:
                                 self.dragging = True
-                                hwnd = pygame.display.get_wm_info()["window"]
-                                window_rect = win32gui.GetWindowRect(hwnd)
-                                mouse_screen_x, mouse_screen_y = win32api.GetCursorPos()
-                                self.drag_offset = (mouse_screen_x - window_rect[0], mouse_screen_y - window_rect[1])
+                                window_x, window_y = self.platform.window_position()
+                                mouse_screen_x, mouse_screen_y = self.platform.cursor_position()
+                                self.drag_offset = (mouse_screen_x - window_x, mouse_screen_y - window_y)
                     elif event.type == pygame.MOUSEBUTTONUP:
                         if event.button == 1:
                             self.dragging = False
                     elif event.type == pygame.MOUSEMOTION:
                         if self.dragging and not self.is_fullscreen:
-                            mouse_screen_x, mouse_screen_y = win32api.GetCursorPos()
+                            mouse_screen_x, mouse_screen_y = self.platform.cursor_position()
                             new_x = mouse_screen_x - self.drag_offset[0]
                             new_y = mouse_screen_y - self.drag_offset[1]
                             self.window_pos = (new_x, new_y)
-                            hwnd = pygame.display.get_wm_info()["window"]
-                            win32gui.SetWindowPos(hwnd, win32con.HWND_TOP, new_x, new_y, 0, 0, 
-                                                win32con.SWP_NOSIZE | win32con.SWP_NOZORDER)
-
-                time.sleep(0.01)
+                            self.platform.move_window(new_x, new_y)
+
+                self.run_hotkey_actions()
+                if self.running:
+                    now = time.perf_counter()
+                    if now - self.stream_check_time >= 1.0:
+                        self.stream_check_time = now
+                        self.check_streams()
+                    self.render_frame()
+                    if not self.startup_reported:
+                        self.mark_startup('first_frame')
+                        self.report_startup()
+                    if self.standby_source is not None:
+                        self.open_standby_stream(self.standby_source)
+                        self.standby_source = None
+                self.clock.tick(self.current_fps)
+
+            self.audio_buffer.wake()
+            audio_thread.join()
+            if replay_thread is not None:
+                replay_thread.join()
+                replay_source.close()
+            self.report_thread_stats()
+            if self.stats_log_path:
+                self.write_stats_log()
 
         finally:
-            if self.stream:
-                self.stream.stop_stream()
-                self.stream.close()
+            self.stop_dsp_process()
+            self.streams.close_all()
             if self.audio:
                 self.audio.terminate()
+            if self.recorder is not None:
+                self.recorder.close()
+            print(f"Audio buffer: {self.audio_buffer.overruns} overruns, {self.audio_buffer.dropped_frames} dropped frames")
+            if self.spectrum_sender is not None:
+                print(f"Spectrum output: {self.spectrum_sender.sent} sent, {self.spectrum_sender.dropped} dropped")
+                self.spectrum_sender.close()
             pygame.quit()
-            keyboard.unhook_all()
+            self.platform.remove_hotkeys()
+            self.settings_store.close()
+
+    def render_offline(self, wav_path, output_dir=None, raw=False, fps=None):
+        fps = fps or self.TARGET_FPS
+        with wave.open(wav_path, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError("Only 16-bit PCM WAV files are supported")
+            channels = wav.getnchannels()
+            self.CHANNELS = channels
+            self.configure_pipeline(rate=wav.getframerate())
+
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            stdout = sys.stdout.buffer
+
+            samples_per_frame = self.RATE / fps
+            next_frame_at = 0.0
+            position = 0
+            frames_written = 0
+            chunks_processed = 0
+            start_time = time.perf_counter()
+
+            while True:
+                in_data = wav.readframes(self.CHUNK)
+                frame_count = len(in_data) // (2 * channels)
+                if frame_count == 0:
+                    break
+                audio_data = np.frombuffer(in_data, dtype=np.int16)
+                if frame_count < self.CHUNK:
+                    audio_data = np.pad(audio_data, (0, (self.CHUNK - frame_count) * channels))
+
+                smoothed_heights = self.process_chunk(audio_data)
+                if smoothed_heights is None:
+                    smoothed_heights = self.smoother.output
+                chunks_processed += 1
+                position += frame_count
+
+                while position >= next_frame_at:
+                    self.update_beat_effect(self.beat_detector.beats, next_frame_at / self.RATE)
+                    self.update_visualization(smoothed_heights, self.smoother.peak_output)
+                    if raw:
+                        stdout.write(pygame.image.tobytes(self.screen, 'RGB'))
+                    elif output_dir:
+                        pygame.image.save(self.screen, os.path.join(output_dir, f"frame_{frames_written:06d}.png"))
+                    frames_written += 1
+                    next_frame_at += samples_per_frame
+
+            if raw:
+                stdout.flush()
+
+        elapsed = time.perf_counter() - start_time
+        audio_seconds = position / self.RATE
+        print(f"Rendered {frames_written} frames ({chunks_processed} chunks, {audio_seconds:.1f} s of audio) "
+              f"in {elapsed:.2f} s: {frames_written / max(elapsed, 1e-9):.1f} fps, "
+              f"{audio_seconds / max(elapsed, 1e-9):.1f}x real time", file=sys.stderr)
+        print(f"Output: {self.SCREEN_WIDTH}x{self.SCREEN_HEIGHT} @ {fps} fps", file=sys.stderr)
+        return frames_written
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=f"Sound Visualizer v{SoundVisualizer.VERSION}")
+    parser.add_argument('--render', metavar='WAV', help="render a 16-bit WAV file offline instead of live capture")
+    parser.add_argument('--output', metavar='DIR', help="write rendered frames to DIR as a PNG sequence")
+    parser.add_argument('--raw', action='store_true', help="write rendered frames to stdout as raw RGB24")
+    parser.add_argument('--size', metavar='WxH', help="output frame size for --render, e.g. 1920x1080")
+    parser.add_argument('--fps', type=int, help="output frame rate for --render")
+    parser.add_argument('--view', choices=('bars', 'waterfall'), help="visualization for --render")
+    parser.add_argument('--record', metavar='FILE', help="record captured PCM to a rolling memory-mapped file")
+    parser.add_argument('--record-seconds', type=float, default=300, help="capacity of the --record file in seconds")
+    parser.add_argument('--replay', metavar='FILE', help="use a --record capture file as the audio source")
+    parser.add_argument('--replay-speed', choices=('realtime', 'max'), default='realtime',
+                        help="replay at the recorded pace or as fast as the DSP thread can go")
+    parser.add_argument('--headless', action='store_true', help="run --replay without a window")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    visualizer = SoundVisualizer()
-    visualizer.run() 
\ No newline at end of file
+    multiprocessing.freeze_support()
+    args = parse_args()
+    if args.render:
+        size = tuple(int(v) for v in args.size.lower().split('x')) if args.size else None
+        visualizer = SoundVisualizer(headless=True, size=size)
+        if args.view:
+            visualizer.view_mode = args.view
+        try:
+            visualizer.render_offline(args.render, args.output, args.raw, args.fps)
+        finally:
+            pygame.quit()
+    else:
+        visualizer = SoundVisualizer(headless=args.headless and bool(args.replay))
+        if args.record:
+            visualizer.start_recording(args.record, args.record_seconds)
+        visualizer.run(args.replay, args.replay_speed == 'realtime') 
\ No newline at end of file
@@ -0,0 +1,28 @@
+import pytest
+
+from benchmark import CHANNEL_MODES, allocations_ok, check_allocations
+
+CHUNK = 1024
+WARMUP = 400
+CHUNKS = 200
+CONFIGS = [(1024, 32), (8192, 256)]
+
+
+def measure(fft_size, num_bars):
+    results = check_allocations(48000, CHUNK, fft_size, fft_size // 4, num_bars, CHUNKS, WARMUP)
+    return {(result['channel_mode'], result['channels']): result for result in results}
+
+
+@pytest.mark.parametrize('fft_size, num_bars', CONFIGS)
+def test_no_growth_per_chunk(fft_size, num_bars):
+    for mode, result in measure(fft_size, num_bars).items():
+        assert allocations_ok(result), (mode, result)
+
+
+def test_peak_independent_of_frame_size():
+    measure(*CONFIGS[0])
+    small = measure(*CONFIGS[0])
+    large = measure(*CONFIGS[1])
+    # A temporary sized by the FFT or the band count would show up as a difference here
+    for mode in CHANNEL_MODES:
+        assert large[mode]['peak_bytes'] - small[mode]['peak_bytes'] <= 512, mode